@@ -2,24 +2,31 @@
 import os
 # os.environ["STREAMLIT_WATCHER_TYPE"] = "none"
 import streamlit as st
-from modules.rag_colpali import ColPaliRAG
+from modules.rag_colpali import ColPaliRAG, AsyncColPaliRAG, QueryCache
+from modules.local_retrieval import InMemoryPageIndex, ColPaliQueryEncoder, LocalColPaliRAG
+from modules.multivector_index import MultiVectorIndex
 import streamlit.components.v1 as components
-from modules.Mind_Map import RAGExtensions 
+from modules.Mind_Map import RAGExtensions, MINDMAP_FAILURE_HTML
 import requests
 # import aifc
 from modules.router import judge_relevance, web_search_agent ,judge_answer_relevance
 import json 
 from lipsync import LipSync
-from modules.router import router
+from modules.router import router, routing_stats
 from modules.response_router import route_response
 from modules.chatbot import Chatbot
 import torch
-from pydub import AudioSegment
+from modules.audio import pcm_to_wav, write_wav, pcm_duration
+from modules.lipsync_jobs import LipSyncJobQueue, FINISHED_STATES
+from modules.artifacts import ArtifactStore
+from modules.base_video import BaseVideoCache
 from modules.preference_test import render_test_ui, load_saved_result
 from io import BytesIO
 import base64
 import markdown
 import time
+import asyncio
+import config
 
 
 
@@ -30,8 +37,7 @@ st.title("🧠 FAHEM.AI")
 st.markdown("Upload a PDF and chat in English or Arabic. Hover over citations for details.")
 
 
-@st.cache_resource
-def load_lipsync():
+def create_lipsync():
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     return LipSync(
         model='wav2lip',
@@ -40,21 +46,78 @@ def load_lipsync():
         device=device,
         img_size=96,
         save_cache=True,
-        fps=25
+        fps=config.LIPSYNC_FPS
     )
-if "lipsync" not in st.session_state:
-    st.session_state["lipsync"] = load_lipsync()
 # Paths for lip-sync video generation
 base_video_path = r"C:\Users\REWAN\Downloads\FAHEM\FAHEM\final.mp4"
 checkpoint_path = r"wav2lip.pth"
+
+
+@st.cache_resource
+def load_artifact_store():
+    """Shared store for generated audio/video files (per-session, per-turn paths under a disk quota)."""
+    return ArtifactStore()
+
+
+@st.cache_resource
+def load_base_video():
+    """Frames and face detections of the fixed base video, computed once and shared by every render."""
+    return BaseVideoCache(base_video_path, img_size=96)
+
+
+@st.cache_resource
+def load_lipsync_queue():
+    """One render queue per process; config.LIPSYNC_MAX_CONCURRENT caps concurrent renders across users."""
+    base_video = load_base_video()
+    return LipSyncJobQueue(lambda: base_video.install(create_lipsync()), checkpoint_path)
 cache_dir = r"C:\Users\REWAN\Downloads\FAHEM\FAHEM\cache"
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 
 
+@st.cache_resource
+def load_query_cache():
+    """One response cache per process, so every session asking about the same document shares it."""
+    return QueryCache() if config.QUERY_CACHE_ENABLED else None
+
+
+@st.cache_resource
+def load_local_index(path: str):
+    """
+    Page embeddings and the query encoder, loaded once per process and shared by every session.
+    A directory is a memory-mapped quantized index (modules/multivector_index.py); a file is an .npz.
+    """
+    index = MultiVectorIndex.open(path) if os.path.isdir(path) else InMemoryPageIndex.from_npz(path)
+    return index, ColPaliQueryEncoder()
+
+
+def usable_mindmap(html):
+    """The backend answers 200 OK with a failure placeholder when extraction fails; never keep that as a map."""
+    return html if html and html.strip() != MINDMAP_FAILURE_HTML else None
+
+
+async def _preload(api_url: str) -> dict:
+    async with AsyncColPaliRAG(api_url) as client:
+        return await client.preload(num_cards=config.PRELOAD_NUM_FLASH_CARDS)
+
+
+def preload_study_material(api_url: str):
+    """Fetch the mind map and flash cards concurrently (wall time = slowest call, not the sum)."""
+    loaded = asyncio.run(_preload(api_url))
+    st.session_state.mindmap_html = usable_mindmap(loaded["mindmap_html"])
+    st.session_state.flash_cards_html = loaded["flash_cards_html"]
+    for name, error in loaded["errors"].items():
+        print(f"⚠️ Preloading {name} failed: {error}")
+
+
 # --- Session State Initialization (with Quiz additions) ---
 if "rag_client" not in st.session_state:
     st.session_state.rag_client = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = ArtifactStore.new_session_id()
+if "chatbot" not in st.session_state:
+    # Per-session chat history; the underlying Gemini models are shared process-wide
+    st.session_state.chatbot = Chatbot()
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "view_mode" not in st.session_state:
@@ -73,10 +136,24 @@ if "quiz_results" not in st.session_state:
 ngrok_url = os.getenv("NGROK_URL", "")
 # ngrok_url = st.sidebar.text_input("Paste your ngrok URL here", key="ngrok_url")
 
+if config.LOCAL_INDEX_PATH and st.session_state.rag_client is None:
+    try:
+        index, query_encoder = load_local_index(config.LOCAL_INDEX_PATH)
+        st.session_state.rag_client = LocalColPaliRAG(
+            index, query_encoder, chatbot=st.session_state.chatbot, cache=load_query_cache()
+        )
+        st.sidebar.success(f"✅ Local index loaded ({len(index)} pages)")
+        st.rerun()
+    except Exception as e:
+        st.sidebar.error(f"❌ Loading the local index failed: {e}")
+
 if ngrok_url and st.session_state.rag_client is None:
     try:
-        st.session_state.rag_client = ColPaliRAG(api_url=ngrok_url)
+        st.session_state.rag_client = ColPaliRAG(api_url=ngrok_url, cache=load_query_cache())
         st.sidebar.success("✅ Connected to API server!")
+        if config.PRELOAD_ON_CONNECT:
+            with st.spinner("🎨 Preparing mind map and flash cards..."):
+                preload_study_material(ngrok_url)
         st.rerun()
     except Exception as e:
         st.sidebar.error(f"❌ Connection failed: {e}")
@@ -87,9 +164,13 @@ if st.session_state.rag_client:
     st.sidebar.title("📊 View Options")
     
     # --- UPDATED: Added "📝 Quiz" to the list ---
+    view_options = ["💬 Chat Interface", "🧠 Mind Map", "🎴 Flash Cards","📝 Quiz", "📝 Learning Style Test"]
+    if isinstance(st.session_state.rag_client, LocalColPaliRAG):
+        # Mind map, flash cards and quizzes are generated by the backend
+        view_options = ["💬 Chat Interface", "📝 Learning Style Test"]
     view_option = st.sidebar.radio(
     "Select View:",
-    ["💬 Chat Interface", "🧠 Mind Map", "🎴 Flash Cards","📝 Quiz", "📝 Learning Style Test"],
+    view_options,
     key="view_selector"
 )
 
@@ -103,14 +184,14 @@ if st.session_state.rag_client:
         if st.session_state.mindmap_html is None:
             with st.spinner("🎨 Generating mind map..."):
                 try:
-                    # Use the full ngrok_url from session state for reliability
-                    api_url = st.session_state.rag_client.api_url
-                    response = requests.get(f"{api_url}/mindmap", timeout=60)
-                    if response.status_code == 200:
-                        st.session_state.mindmap_html = response.text
+                    # The backend caches generated maps per document (page-text hash), so this is fast for known PDFs
+                    st.session_state.mindmap_html = usable_mindmap(st.session_state.rag_client.mindmap())
+                    if st.session_state.mindmap_html:
                         st.sidebar.success("✅ Mind map loaded!")
                     else:
-                        st.sidebar.error(f"❌ Failed to load mind map: {response.status_code}")
+                        st.sidebar.error("❌ The mind map could not be generated for this document.")
+                except requests.HTTPError as e:
+                    st.sidebar.error(f"❌ Failed to load mind map: {e.response.status_code}")
                 except Exception as e:
                     st.sidebar.error(f"❌ Error loading mind map: {e}")
     
@@ -134,12 +215,21 @@ if st.session_state.rag_client:
             components.html(st.session_state.mindmap_html, height=850, scrolling=False)
         else:
             st.info("The mind map is loading or failed to load. Check the sidebar for status.")
-            if st.button("🔄 Refresh Mind Map"):
-                st.session_state.mindmap_html = None
-                st.rerun()
+        # Always available: e.g. after uploading another PDF to the backend
+        if st.button("🔄 Refresh Mind Map"):
+            st.session_state.mindmap_html = None
+            if isinstance(st.session_state.rag_client, ColPaliRAG):
+                st.session_state.rag_client.refresh_index_version()
+            st.rerun()
     
     # CHAT VIEW (No changes)
     elif st.session_state.view_mode == "chat":
+        with st.sidebar.expander("📈 Routing stats"):
+            stats = routing_stats()
+            gate_stats = stats["relevance_gate"]
+            st.metric("Decided without the LLM judge", f"{gate_stats['local_decision_rate']:.0%}")
+            st.json(stats)
+
         # Display chat history
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
@@ -168,7 +258,8 @@ if st.session_state.rag_client:
                         retrieved_docs = temp_response.get("retrieved", [])
 
                         # 2️⃣ Router decides (LLM intent + relevance + threshold)
-                        llm = Chatbot().model
+                        chat = st.session_state.chatbot
+                        llm = chat.model
                         judge_llm = llm  # e.g., Gemini Flash or local model
                         # is_relevant = judge_answer_relevance(judge_llm, prompt, temp_response.get("answer", ""))
                         routing_result = router(llm, retrieved_docs,temp_response.get("answer", ""), prompt, min_score_threshold=0.4)
@@ -176,17 +267,20 @@ if st.session_state.rag_client:
                         context = routing_result.get("context", "")
 
                         # 3️⃣ Answer generation
+                        streamed = False
                         if route_mode == "internal":
                             response_data = temp_response
                             base_answer = response_data["answer"]
                             retrieved = response_data.get("retrieved", [])
                         else:
-                            # Using the context returned by Tavily agent
+                            # Using the context returned by Tavily agent; stream it so the first tokens show immediately
                             web_context = routing_result["context"]
-                            web_answer_resp = llm.generate_content(
-                                f"Answer the question using this web info:\n\n{web_context}\n\nQ: {prompt}"
-                            )
-                            base_answer = getattr(web_answer_resp, "text", None) or "No answer found."
+                            base_answer = st.empty().write_stream(
+                                chat.answer_with_context_stream(
+                                    prompt, f"Web search results:\n\n{web_context}", max_tokens=2048, source="web"
+                                )
+                            ) or "No answer found."
+                            streamed = True
                             retrieved = []  # no structured sources from web
 
                         
@@ -232,7 +326,6 @@ if st.session_state.rag_client:
 
                         #####################
          # 2️⃣ Generate answer using Chatbot with the chosen context
-                        chat = Chatbot()
                         # try:
                         #     base_answer =base_answer
                         #     # st.write(f"🌐 Language: {'Arabic' if language=='ar' else 'English'}")
@@ -242,9 +335,25 @@ if st.session_state.rag_client:
 
                         # 4️⃣ Route response
                         # chat = Chatbot()
-                        routed = route_response(style, base_answer,chat)
+                        # Start playback with the first synthesized chunk while the rest is still being generated
+                        audio_preview = st.empty()
+
+                        def preview_first_chunk(index, pcm):
+                            if index != 0 or style != "audio":
+                                return
+                            with audio_preview.container():
+                                st.caption("▶️ Beginning of the answer — the full audio follows below once it is ready")
+                                st.audio(pcm_to_wav(pcm), format="audio/wav")
+
+                        routed = route_response(style, base_answer, chat, on_audio_chunk=preview_first_chunk)
+                        if routed["type"] != "audio":
+                            audio_preview.empty()
                                     # 5️⃣ Display output
-                        if routed["type"] == "text":
+                        if routed["type"] == "text" and streamed:
+                            # Already rendered incrementally above
+                            st.session_state.messages.append({"role": "assistant", "content": base_answer})
+
+                        elif routed["type"] == "text":
                             answer_html = st.session_state.rag_client.build_citation_html(base_answer, retrieved)
                             components.html(answer_html, height=800, scrolling=False)
                             st.session_state.messages.append({
@@ -254,11 +363,10 @@ if st.session_state.rag_client:
                             })
 
                         elif routed["type"] == "audio":
-                            audio_bytes = routed["content"]
-                            audio_seg = AudioSegment(data=audio_bytes, sample_width=2, frame_rate=24000, channels=1)
-                            audio_path = "answeraudio.wav"
-                            audio_seg.export(audio_path, format="wav")
-                            st.audio(audio_path, format="audio/wav")
+                            audio_bytes = routed["content"]  # already a WAV, playable in memory
+                            # The preview stays above (it may be playing); the full answer is a separate player
+                            st.caption("🔊 Full answer")
+                            st.audio(audio_bytes, format="audio/wav")
                             st.session_state.messages.append({
                                 "role": "assistant",
                                 "content": "Audio response generated.",
@@ -268,19 +376,37 @@ if st.session_state.rag_client:
                             })
                         elif routed["type"] == "video":
                             audio_bytes = routed["content"]
-                            audio_seg = AudioSegment(data=audio_bytes, sample_width=2, frame_rate=24000, channels=1)
-                            audio_path = "answeraudio.wav"
-                            audio_seg.export(audio_path, format="wav")
-
-                            st.info("⏳ Processing video...")
-                            start_time = time.time()
-                            lip = st.session_state["lipsync"]
-                            output_video_path = os.path.join(os.getcwd(), "output_synced_video.mp4")
+                            artifacts = load_artifact_store()
+                            turn = len(st.session_state.messages)
+                            audio_path = write_wav(
+                                artifacts.path_for(st.session_state.session_id, turn, "answer.wav"), routed["pcm"]
+                            )
+                            artifacts.register(audio_path)
+
+                            output_video_path = artifacts.path_for(st.session_state.session_id, turn, "answer.mp4")
                             try:
-                                lip.sync(base_video_path, audio_path, output_video_path)
-                                end_time = time.time()
-                                st.success(f"✅ Video done! Time: {end_time - start_time:.2f}s")
+                                # Only as many base frames as the answer needs (looped if it is longer than the base video)
+                                base_video = load_base_video()
+                                clip_path = base_video.write_clip(base_video.frames_needed(pcm_duration(routed["pcm"])))
+                                lipsync_queue = load_lipsync_queue()
+                                job_id = lipsync_queue.submit(clip_path, audio_path, output_video_path)
+                                progress_bar = st.progress(0.0, text="⏳ Processing video...")
+                                while True:
+                                    job = lipsync_queue.status(job_id)
+                                    if job["state"] in FINISHED_STATES:
+                                        break
+                                    label = (f"⏳ Waiting for a free renderer ({job['queue_position']} ahead)..."
+                                             if job["state"] == "queued" else "⏳ Processing video...")
+                                    progress_bar.progress(job["progress"], text=label)
+                                    time.sleep(0.5)
+                                progress_bar.empty()
+                                if job["state"] != "done":
+                                    raise RuntimeError(job["error"] or f"lip-sync job {job['state']}")
+                                st.success(f"✅ Video done! Time: {job['elapsed']:.2f}s"
+                                           + (" (cached)" if job["from_cache"] else "")
+                                           + (" (cold start: model load + base-video warm-up)" if job["cold_start"] else ""))
                                 if os.path.exists(output_video_path):
+                                    artifacts.register(output_video_path)
                                     st.video(output_video_path)
                                     st.session_state.messages.append({
                                         "role": "assistant",
@@ -305,8 +431,6 @@ if st.session_state.rag_client:
         st.header("🎴 Study with Flash Cards")
         st.markdown("Generate interactive flash cards from your document to test your knowledge. Click on a card to flip it.")
     
-        api_url = st.session_state.rag_client.api_url
-    
     # Add controls to the sidebar
         with st.sidebar:
             st.markdown("---")
@@ -320,15 +444,11 @@ if st.session_state.rag_client:
         if st.button("✨ Generate Flash Cards", use_container_width=True):
             with st.spinner("🤖 Generating flash cards..."):
                 try:
-                    data = {"num_cards": str(num_cards_to_generate)}
-                    response = requests.post(f"{api_url}/generate_flash_cards", data=data, timeout=180)
-                
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        st.session_state.flash_cards_html = response_data.get("html")
-                    else:
-                        st.error(f"Error generating flash cards: {response.text}")
-                        st.session_state.flash_cards_html = None
+                    response_data = st.session_state.rag_client.generate_flash_cards(num_cards_to_generate)
+                    st.session_state.flash_cards_html = response_data.get("html")
+                except requests.HTTPError as e:
+                    st.error(f"Error generating flash cards: {e.response.text}")
+                    st.session_state.flash_cards_html = None
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
                     st.session_state.flash_cards_html = None
@@ -343,7 +463,6 @@ if st.session_state.rag_client:
         st.header("📝 Test Your Knowledge")
         
         col1, col2 = st.columns([1, 2])
-        api_url = st.session_state.rag_client.api_url
 
         with col1:
             with st.form("quiz_generation_form"):
@@ -353,14 +472,13 @@ if st.session_state.rag_client:
                 lang = st.selectbox("Quiz Language", ["en", "ar"])
                 if st.form_submit_button("✨ Generate Quiz", use_container_width=True):
                     with st.spinner("🤖 Generating new quiz..."):
-                        data = {"num_mcq": str(num_mcq), "num_tf": str(num_tf), "lang": lang}
-                        response = requests.post(f"{api_url}/generate_quiz", data=data, timeout=180)
-                        if response.status_code == 200:
-                            st.session_state.quiz_data = response.json().get("quiz")
+                        try:
+                            response_data = st.session_state.rag_client.generate_quiz(num_mcq, num_tf, lang)
+                            st.session_state.quiz_data = response_data.get("quiz")
                             st.session_state.quiz_results = None
                             st.success("Quiz generated!")
-                        else:
-                            st.error(f"Error: {response.text}")
+                        except requests.HTTPError as e:
+                            st.error(f"Error: {e.response.text}")
             
             if st.session_state.quiz_results:
                 results = st.session_state.quiz_results
@@ -419,9 +537,10 @@ if st.session_state.rag_client:
                         feedback = {}
                         if incorrect_for_feedback:
                             with st.spinner("🤖 Getting feedback..."):
-                                payload = {"incorrect_answers": incorrect_for_feedback}
-                                response = requests.post(f"{api_url}/grade_quiz", json=payload, timeout=180)
-                                if response.status_code == 200: feedback = response.json().get("feedback", {})
+                                try:
+                                    feedback = st.session_state.rag_client.grade_quiz(incorrect_for_feedback).get("feedback", {})
+                                except requests.RequestException as e:
+                                    print(f"⚠️ Quiz grading failed: {e}")
                         
                         st.session_state.quiz_results = {"score": score, "total": total, "incorrect": incorrect_for_feedback, "feedback": feedback}
                         st.rerun()
@@ -5,16 +5,175 @@ from google.generativeai.types import GenerationConfig, HarmCategory, HarmBlockT
 import config
 from google.generativeai import types
 
+import re
+import threading
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+from modules.utils import DiskCache
+
 genai.configure(api_key="")
 
+# ==============================
+# Shared model instances
+# ==============================
+# Model/client objects are stateless and thread-safe to call, so one instance per
+# name is shared by every Chatbot in the process; chat history stays per Chatbot.
+_shared_lock = threading.Lock()
+_shared_instances = {}
+
+
+def _shared_instance(key, factory):
+    instance = _shared_instances.get(key)
+    if instance is None:
+        with _shared_lock:
+            instance = _shared_instances.get(key)
+            if instance is None:
+                instance = factory()
+                _shared_instances[key] = instance
+    return instance
+
+
+def get_text_model(model_name: str = config.GEMINI_MODEL):
+    """Process-wide text GenerativeModel."""
+    return _shared_instance(("text", model_name), lambda: genai.GenerativeModel(model_name))
+
+
+def get_tts_model(model_name: str = config.GEMINI_TTS_MODEL):
+    """Process-wide single-voice TTS GenerativeModel."""
+    return _shared_instance(("tts", model_name), lambda: genai.GenerativeModel(model_name))
+
+
+def get_tts_client():
+    """Process-wide google.genai client used for multi-speaker TTS."""
+    def create():
+        from google import genai as genai_client
+        return genai_client.Client(api_key="")
+    return _shared_instance(("tts_client",), create)
+
+
+# ==============================
+# TTS audio cache
+# ==============================
+class AudioCache:
+    """
+    Persistent cache of synthesized raw PCM, keyed by a hash of
+    (text, TTS model, voice / speaker config). Evicts by total bytes and age.
+    """
+
+    def __init__(self, directory: str = config.TTS_CACHE_DIR, max_bytes: int = config.TTS_CACHE_MAX_BYTES,
+                 max_age: float = config.TTS_CACHE_MAX_AGE):
+        self.store = DiskCache(directory, max_bytes=max_bytes, ttl=max_age, suffix=".pcm")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, model: str, voice_config: dict) -> str:
+        raw = json.dumps([text, model, voice_config], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        data = self.store.get(key)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def set(self, key: str, pcm: bytes):
+        self.store.set(key, pcm)
+
+
+def get_audio_cache():
+    """Process-wide TTS audio cache, or None when disabled in config."""
+    if not config.TTS_CACHE_ENABLED:
+        return None
+    return _shared_instance(("audio_cache",), AudioCache)
+
+
+def get_tts_executor():
+    """Process-wide bounded worker pool for concurrent TTS chunk requests."""
+    return _shared_instance(
+        ("tts_executor",),
+        lambda: ThreadPoolExecutor(max_workers=config.TTS_MAX_WORKERS, thread_name_prefix="tts"),
+    )
+
+
+def get_tts_first_chunk_executor():
+    """Process-wide pool reserved for each answer's first chunk, so it never queues behind other answers."""
+    return _shared_instance(
+        ("tts_first_chunk_executor",),
+        lambda: ThreadPoolExecutor(max_workers=config.TTS_FIRST_CHUNK_WORKERS, thread_name_prefix="tts-first"),
+    )
+
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?؟。])\s+|\n+")
+_SPEAKER_TURN_RE = re.compile(r"^\s*[\w\u0600-\u06FF]+\s*:")
+
+
+def _pack(pieces: list, max_chars: int, sep: str) -> list:
+    """Greedily join consecutive pieces into chunks of at most max_chars (a longer piece stays whole)."""
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(sep) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}{sep}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def has_speaker_turns(text: str) -> bool:
+    """True when at least one line starts with a "Name:" speaker label."""
+    return any(_SPEAKER_TURN_RE.match(line) for line in (text or "").splitlines())
+
+
+def _split_turn(turn: str, max_chars: int) -> list:
+    """An over-long speaker turn as sentence-packed pieces, each repeating the turn's "Name:" label."""
+    if len(turn) <= max_chars:
+        return [turn]
+    match = _SPEAKER_TURN_RE.match(turn)
+    label = f"{match.group(0).strip()} " if match else ""
+    body = turn[match.end():] if match else turn
+    sentences = [p.strip() for p in _SENTENCE_END_RE.split(body) if p and p.strip()]
+    return [label + piece for piece in _pack(sentences, max(1, max_chars - len(label)), " ")]
+
+
+def split_speech_chunks(text: str, max_chars: int = config.TTS_CHUNK_MAX_CHARS, speaker_turns: bool = False) -> list:
+    """
+    Split text for chunked TTS. Sentence mode packs whole sentences; speaker-turn mode
+    packs "Joe: ..." / "Jane: ..." turns, splitting an over-long turn at sentence
+    boundaries with its label repeated on every piece. Text without any speaker label
+    falls back to sentence mode.
+    """
+    if speaker_turns and has_speaker_turns(text):
+        turns = []
+        for line in (text or "").splitlines():
+            if not line.strip():
+                continue
+            if _SPEAKER_TURN_RE.match(line) or not turns:
+                turns.append(line.strip())
+            else:
+                turns[-1] += " " + line.strip()
+        pieces = [piece for turn in turns for piece in _split_turn(turn, max_chars)]
+        return _pack(pieces, max_chars, "\n")
+    sentences = [p.strip() for p in _SENTENCE_END_RE.split(text or "") if p and p.strip()]
+    return _pack(sentences, max_chars, " ")
+
+
 class Chatbot:
-    def __init__(self, model_name=config.GEMINI_MODEL, tts_model=config.GEMINI_TTS_MODEL):
+    def __init__(self, model_name=config.GEMINI_MODEL, tts_model=config.GEMINI_TTS_MODEL, audio_cache=None):
         self.model_name = model_name
         self.tts_model = tts_model
         
-        self.model = genai.GenerativeModel(model_name)
-        self.tts = genai.GenerativeModel("models/gemini-2.5-flash-preview-tts")
+        self.model = get_text_model(model_name)
+        self.tts = get_tts_model(tts_model)
+        self.audio_cache = audio_cache if audio_cache is not None else get_audio_cache()
         self.chat_history = []
+        self.last_language = "en"
 
     def detect_language(self, text):
         """Simple language detection based on character patterns."""
@@ -25,10 +184,12 @@ class Chatbot:
         arabic_ratio = arabic_chars / total_chars
         return "ar" if arabic_ratio > 0.3 else "en"
 
-    def answer_with_context(
-        self, user_query: str, context: str, style: str = "text",
-        temperature: float = 0.2, max_tokens: int = 512
-    ):
+    def _build_prompt(self, user_query: str, context: str, style: str = "text", source: str = "document"):
+        """
+        Build the grounded-answer prompt; returns (prompt, query_lang).
+        source="document" asks for [n] citations of the numbered passages; source="web"
+        grounds the answer on unnumbered web search results, so it asks for none.
+        """
         query_lang = self.detect_language(user_query)
         
         style_instructions = {
@@ -43,6 +204,9 @@ Keep it friendly, short, and easy to understand.""",
             "video": "Write a smooth narration for a short educational video. Do not include scene directions or character names. Make it sound like a clear voiceover script.."
         }
 
+        if source == "web":
+            return self._build_web_prompt(user_query, context, style, query_lang, style_instructions), query_lang
+
         if query_lang == "ar":
             system_prompt = (
                 "أنت مساعد متخصص في تحليل المستندات. أجب على سؤال المستخدم باستخدام السياق المقدم فقط. "
@@ -63,6 +227,36 @@ Keep it friendly, short, and easy to understand.""",
             f"\n\n{'سؤال المستخدم' if query_lang == 'ar' else 'User Question'}: {user_query}\n\n"
             f"{'الإجابة مع الاستشهادات' if query_lang == 'ar' else 'Answer with inline citations'}:"
         )
+        return prompt, query_lang
+
+    @staticmethod
+    def _build_web_prompt(user_query: str, context: str, style: str, query_lang: str, style_instructions: dict) -> str:
+        """Prompt for answers grounded on web search results (no numbered passages, so no [n] citations)."""
+        if query_lang == "ar":
+            system_prompt = (
+                "أنت مساعد بحث. أجب على سؤال المستخدم باستخدام نتائج البحث على الويب المقدمة فقط. "
+                "لا تستخدم استشهادات مرقمة. "
+                "أجب باللغة العربية فقط. إذا لم تجد الإجابة في النتائج، أخبر المستخدم بذلك بوضوح.\n\n"
+            )
+        else:
+            system_prompt = (
+                "You are a research assistant. Answer the user's question using ONLY the provided web search results. "
+                "Do not use numeric citations. "
+                "Answer in English only. If the answer is not present in the search results, clearly state that you cannot find it.\n\n"
+                f"Adapt your explanation to this learning style: {style_instructions.get(style.lower(), style_instructions['text'])}\n\n"
+            )
+        return (
+            system_prompt +
+            (context or "") +
+            f"\n\n{'سؤال المستخدم' if query_lang == 'ar' else 'User Question'}: {user_query}\n\n"
+            f"{'الإجابة' if query_lang == 'ar' else 'Answer'}:"
+        )
+
+    def answer_with_context(
+        self, user_query: str, context: str, style: str = "text",
+        temperature: float = 0.2, max_tokens: int = 512
+    ):
+        prompt, query_lang = self._build_prompt(user_query, context, style)
         print(f"Generated prompt: {prompt}")
         
         try:
@@ -103,24 +297,77 @@ Keep it friendly, short, and easy to understand.""",
             print(f"❌ Gemini generation error: {e}")
             return f"Error generating answer: {e}", query_lang
 
+    def answer_with_context_stream(
+        self, user_query: str, context: str, style: str = "text",
+        temperature: float = 0.2, max_tokens: int = 512, source: str = "document"
+    ):
+        """
+        Streaming variant of answer_with_context: yields text chunks as Gemini produces them.
+        The full answer is appended to chat_history once the stream completes.
+        The detected language is available as self.last_language as soon as the generator starts.
+        Pass source="web" for web search results (see _build_prompt).
+        """
+        prompt, query_lang = self._build_prompt(user_query, context, style, source)
+        self.last_language = query_lang
+        parts = []
+        try:
+            response = self.model.generate_content(
+                prompt,
+                generation_config=GenerationConfig(
+                    temperature=temperature,
+                    max_output_tokens=max_tokens,
+                ),
+                stream=True
+            )
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunk without text parts (e.g. finish/safety metadata only)
+                    continue
+                if text:
+                    parts.append(text)
+                    yield text
+        except Exception as e:
+            print(f"❌ Gemini generation error: {e}")
+            message = f"Error generating answer: {e}"
+            parts.append(message)
+            yield message
+            return
+
+        if not parts:
+            yield "⚠️ No valid text response returned from Gemini."
+            return
+        self.chat_history.append({
+            "question": user_query,
+            "answer": "".join(parts),
+            "language": query_lang
+        })
+
 
-    def text_to_speech(self, text: str, voice_name: str = "Kore"):
+    def _synthesize_speech(self, text: str, voice_name: str = "Kore"):
         """
-        Generate speech audio using Gemini TTS.
-        Returns raw PCM bytes for st.audio().
+        Generate speech audio for one chunk using Gemini TTS.
+        Returns raw PCM bytes, or None on failure.
         """
+        speech_config = {
+            "voice_config": {
+                "prebuilt_voice_config": {
+                    "voice_name": "charon"
+                }
+            }
+        }
+        cache_key = AudioCache.make_key(text, self.tts_model, speech_config)
+        if self.audio_cache is not None:
+            cached = self.audio_cache.get(cache_key)
+            if cached is not None:
+                return cached
         try:
             response = self.tts.generate_content(
                 [text],
                 generation_config={
                     "response_modalities": ["AUDIO"],
-                    "speech_config": {
-                        "voice_config": {
-                            "prebuilt_voice_config": {
-                                "voice_name": "charon"
-                            }
-                        }
-                    }
+                    "speech_config": speech_config
                 }
             )
 
@@ -129,7 +376,10 @@ Keep it friendly, short, and easy to understand.""",
                 for part in response.candidates[0].content.parts:
                     if hasattr(part, "inline_data") and part.inline_data is not None:
                         print(f"✅ Audio generated successfully for text: {text}")
-                        return part.inline_data.data
+                        audio = part.inline_data.data
+                        if self.audio_cache is not None:
+                            self.audio_cache.set(cache_key, audio)
+                        return audio
 
             raise RuntimeError("No audio data found in Gemini response")
 
@@ -137,19 +387,21 @@ Keep it friendly, short, and easy to understand.""",
             print(f"🔈 TTS error: {e}")
             return None
         
-    def text_to_speech_Audio(self, text: str, voice_name: str = "Kore"):
+    def _synthesize_dialogue(self, text: str, voice_name: str = "Kore"):
         """
-        Generate speech audio using Gemini TTS with two prebuilt voices.
-        Returns raw PCM bytes (for st.audio or saving as .wav).
-        The input text should include speaker names like:
-        "Joe: Hi Jane!\nJane: Hello Joe!"
+        Generate speech audio for one chunk of dialogue using Gemini TTS with two prebuilt voices.
+        Returns raw PCM bytes, or None on failure.
         """
-        from google import genai
         from google.genai import types
-        self.tts = genai.Client(api_key="")
-        self.tts_model = "gemini-2.5-flash-preview-tts"
+        speakers = {"Joe": voice_name, "Jane": "Puck"}
+        cache_key = AudioCache.make_key(text, self.tts_model, {"multi_speaker": speakers})
+        if self.audio_cache is not None:
+            cached = self.audio_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        client = get_tts_client()
         try:
-            response = self.tts.models.generate_content(
+            response = client.models.generate_content(
                 model=self.tts_model,
                 contents=text,
                 config=types.GenerateContentConfig(
@@ -161,7 +413,7 @@ Keep it friendly, short, and easy to understand.""",
                                     speaker="Joe",
                                     voice_config=types.VoiceConfig(
                                         prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                                            voice_name=voice_name  # Joe's voice (configurable)
+                                            voice_name=speakers["Joe"]  # Joe's voice (configurable)
                                         )
                                     )
                                 ),
@@ -169,7 +421,7 @@ Keep it friendly, short, and easy to understand.""",
                                     speaker="Jane",
                                     voice_config=types.VoiceConfig(
                                         prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                                            voice_name="Puck"  # Jane's voice
+                                            voice_name=speakers["Jane"]  # Jane's voice
                                         )
                                     )
                                 ),
@@ -184,13 +436,75 @@ Keep it friendly, short, and easy to understand.""",
                 for part in response.candidates[0].content.parts:
                     if hasattr(part, "inline_data") and part.inline_data is not None:
                         print(f"✅ Dual-voice audio generated successfully for text:\n{text}")
-                        return part.inline_data.data
+                        audio = part.inline_data.data
+                        if self.audio_cache is not None:
+                            self.audio_cache.set(cache_key, audio)
+                        return audio
 
             raise RuntimeError("No audio data found in Gemini response")
 
         except Exception as e:
             print(f"🔈 TTS error: {e}")
             return None
+
+    def iter_speech(self, text: str, voice_name: str = "Kore", multi_speaker: bool = False):
+        """
+        Split the text into sentence (or speaker-turn) chunks, synthesize them concurrently and
+        yield each chunk's PCM in order as soon as it is ready.
+        The first chunk runs on its own pool, so time to first audio does not depend on what other
+        sessions are synthesizing; the rest share the TTS pool with at most
+        config.TTS_MAX_INFLIGHT_PER_REQUEST chunks of this answer in flight at a time.
+        Yields None for a chunk whose synthesis failed. Dialogue without speaker labels
+        is read in a single voice, chunked by sentence.
+        """
+        multi_speaker = multi_speaker and has_speaker_turns(text)
+        chunks = split_speech_chunks(text, speaker_turns=multi_speaker)
+        synthesize = self._synthesize_dialogue if multi_speaker else self._synthesize_speech
+        if len(chunks) <= 1:
+            yield synthesize(chunks[0] if chunks else text, voice_name)
+            return
+        first = get_tts_first_chunk_executor().submit(synthesize, chunks[0], voice_name)
+        pool = get_tts_executor()
+        window = max(1, config.TTS_MAX_INFLIGHT_PER_REQUEST)
+        pending = deque(pool.submit(synthesize, chunk, voice_name) for chunk in chunks[1:1 + window])
+        next_chunk = 1 + window
+        yield first.result()
+        while pending:
+            pcm = pending.popleft().result()
+            if next_chunk < len(chunks):
+                pending.append(pool.submit(synthesize, chunks[next_chunk], voice_name))
+                next_chunk += 1
+            yield pcm
+
+    def _stitch_speech(self, text: str, voice_name: str, multi_speaker: bool, on_chunk=None):
+        pcm_parts = []
+        for index, pcm in enumerate(self.iter_speech(text, voice_name, multi_speaker)):
+            if pcm is None:
+                return None
+            pcm_parts.append(pcm)
+            if on_chunk is not None:
+                on_chunk(index, pcm)
+        return b"".join(pcm_parts)
+
+    def text_to_speech(self, text: str, voice_name: str = "Kore", on_chunk=None):
+        """
+        Generate speech audio using Gemini TTS.
+        Returns raw PCM bytes for st.audio() (24 kHz, 16-bit mono), or None on failure.
+        on_chunk(index, pcm) is called in order as each sentence chunk becomes ready,
+        so playback can start before the whole answer is synthesized.
+        """
+        return self._stitch_speech(text, voice_name, False, on_chunk)
+
+    def text_to_speech_Audio(self, text: str, voice_name: str = "Kore", on_chunk=None):
+        """
+        Generate speech audio using Gemini TTS with two prebuilt voices.
+        Returns raw PCM bytes (for st.audio or saving as .wav).
+        The input text should include speaker names like:
+        "Joe: Hi Jane!\nJane: Hello Joe!"
+        Over-long turns are split at sentence boundaries, keeping their speaker label;
+        on_chunk works as in text_to_speech.
+        """
+        return self._stitch_speech(text, voice_name, True, on_chunk)
     # def text_to_speech(self, text: str):
     #     """
     #     Generate speech audio using Gemini (v0.8.5).
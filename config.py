@@ -16,3 +16,106 @@ QUIZ_FILE = "ai_generated_questions.json"
 
 # Environment key
 GEMINI_API_KEY_ENV = ""
+
+# ColPali backend (ngrok tunnel) HTTP client
+BACKEND_CONNECT_TIMEOUT = 5        # seconds to establish a connection
+BACKEND_READ_TIMEOUT = 180         # seconds to wait for a response
+BACKEND_POOL_SIZE = 10             # max keep-alive connections kept to the backend
+BACKEND_MAX_RETRIES = 3            # retries for idempotent requests (GET/HEAD)
+BACKEND_RETRY_BACKOFF = 0.5        # exponential backoff factor between retries
+
+# Opt-in: fetch the mind map and flash cards concurrently right after connecting. Off by default, since
+# it makes every new session wait for /mindmap and pay for a flash-card LLM call it may never use;
+# otherwise the mind map is fetched when its view is first opened and flash cards on request.
+PRELOAD_ON_CONNECT = False
+PRELOAD_NUM_FLASH_CARDS = 5
+
+# ColPaliRAG.query response cache (shared by all sessions of the app process).
+# Keys include the backend's index version (BACKEND_INDEX_VERSION_HEADER or an index_version field),
+# read once at connect, then from /query responses and on refresh; against a backend that reports
+# none at connect, the cache is not used at all.
+BACKEND_INDEX_VERSION_HEADER = "X-Index-Version"
+QUERY_CACHE_ENABLED = True
+QUERY_CACHE_MAX_ENTRIES = 512                # in-memory LRU size
+QUERY_CACHE_TTL = 24 * 3600                  # seconds; None keeps entries until evicted
+QUERY_CACHE_DIR = "cache/query_cache"        # on-disk tier; None for memory only
+QUERY_CACHE_DISK_MAX_BYTES = 200 * 1024**2
+
+# Local relevance gate in modules/router.py: combined lexical score in [0, 1].
+# >= ACCEPT keeps the internal answer, <= REJECT goes to web search, the band in between asks the LLM judge.
+RELEVANCE_ACCEPT_THRESHOLD = 0.65
+RELEVANCE_REJECT_THRESHOLD = 0.2
+
+# Speculative web search: when the LLM judge is consulted and the top retrieval score is in
+# [low, high), the Tavily search runs concurrently with the judge (None disables it)
+SPECULATIVE_SEARCH_BAND = (0.4, 0.6)
+SPECULATIVE_SEARCH_WORKERS = 4
+
+# Web search result cache (modules/router.py)
+WEB_SEARCH_CACHE_TTL = 6 * 3600          # seconds a successful search result is reused
+WEB_SEARCH_NEGATIVE_TTL = 60             # seconds a failed search is remembered
+WEB_SEARCH_CACHE_MAX_ENTRIES = 1024
+
+# Synthesized speech cache (raw PCM keyed by text + model + voices)
+TTS_CACHE_ENABLED = True
+TTS_CACHE_DIR = "cache/tts_audio"
+TTS_CACHE_MAX_BYTES = 1024**3            # 1 GB of PCM
+TTS_CACHE_MAX_AGE = 30 * 24 * 3600       # seconds
+
+# Chunked TTS: answers are split at sentence / speaker-turn boundaries and synthesized concurrently
+TTS_CHUNK_MAX_CHARS = 400
+TTS_MAX_WORKERS = 4
+TTS_FIRST_CHUNK_WORKERS = 2               # separate pool for each answer's first chunk (time to first audio)
+TTS_MAX_INFLIGHT_PER_REQUEST = 2          # one answer's chunks in flight on the shared pool at a time
+
+# Lip-sync rendering queue (modules/lipsync_jobs.py)
+LIPSYNC_MAX_CONCURRENT = 1                       # concurrent Wav2Lip renders (one LipSync per worker)
+LIPSYNC_RESULT_CACHE_DIR = "cache/lipsync_videos"
+LIPSYNC_RESULT_CACHE_MAX_BYTES = 2 * 1024**3
+
+# Generated audio/video artifacts (modules/artifacts.py)
+ARTIFACT_DIR = "cache/artifacts"
+ARTIFACT_MAX_BYTES = 2 * 1024**3         # disk quota; least recently used artifacts are evicted beyond it
+ARTIFACT_MAX_AGE = 24 * 3600             # seconds
+
+# Lip-sync base video: decoded frames + face detections cached as memory-mapped arrays
+BASE_VIDEO_CACHE_DIR = "cache/base_video"
+LIPSYNC_FPS = 25
+
+# Mind-map structure extraction for long documents (map-reduce over all pages)
+MINDMAP_CHUNK_TOKENS = 6000      # approximate token budget per map chunk
+MINDMAP_MAX_WORKERS = 8          # concurrent Gemini calls in the map step
+
+# Mind-map cache (server side): structure + HTML per document, keyed by page-text hash
+MINDMAP_CACHE_ENABLED = True
+MINDMAP_CACHE_DIR = "cache/mindmap"
+MINDMAP_CACHE_MAX_BYTES = 500 * 1024**2     # per tier (structures / html)
+MINDMAP_PROMPT_VERSION = "4"                # bump when the extraction prompts or the HTML template change
+
+# PDF rasterization (modules/utils.iter_pdf_images)
+PDF_RENDER_BATCH_PAGES = 8                          # pages per pdftoppm call
+PDF_RENDER_WORKERS = min(4, os.cpu_count() or 1)    # parallel pdftoppm processes
+
+# OCR (modules/ocr.py)
+OCR_LANG = "eng+ara"
+OCR_TESSERACT_CONFIG = "--oem 1 --psm 3"
+OCR_WORKERS = os.cpu_count() or 1
+OCR_CACHE_DIR = "cache/ocr"
+OCR_CACHE_MAX_BYTES = 200 * 1024**2
+
+# Image encoding for HTML payloads (modules/utils.ImageEncoder)
+IMAGE_FORMAT = "JPEG"                   # JPEG / WEBP / PNG
+IMAGE_QUALITY = 80
+IMAGE_MAX_DIM = None                    # longest side in pixels; None keeps full resolution
+IMAGE_CACHE_MAX_BYTES = 64 * 1024**2    # in-memory LRU of encoded images
+MINDMAP_IMAGE_MAX_DIM = 800             # page thumbnails in the mind-map info panel
+
+# Local retrieval (modules/local_retrieval.py): set to a page-embedding index to chat without the Colab backend
+LOCAL_INDEX_PATH = os.getenv("FAHEM_LOCAL_INDEX", "")   # .npz file, or a multivector_index directory
+LOCAL_TOP_K = 3
+LOCAL_SCORE_BATCH_PAGES = 64    # pages scored per matmul batch (bounds the temporary similarity tensor)
+
+# Memory-mapped multi-vector index (modules/multivector_index.py)
+INDEX_QUANTIZATION = "int8"         # "int8" (4x smaller than float32) or "binary" (32x smaller)
+INDEX_RERANK_FACTOR = {"int8": 4, "binary": 32}   # candidates reranked on float16 vectors = k * factor
+INDEX_SCORE_BLOCK_ROWS = 32768      # vectors dequantized per scoring block
@@ -6,37 +6,139 @@ Corrected positioning, scaling, and rendering issues
 import json
 import re
 from collections import Counter
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+import config
+from modules.utils import DiskCache, base64_data_uri, thumbnail_base64
+
+
+# Returned (not cached) when no structure could be extracted; clients must not keep it as a map
+MINDMAP_FAILURE_HTML = "<div>Failed to generate structure.</div>"
+
+
+class PageTextIndex:
+    """
+    Built once per mind map: every page's OCR text lowercased once, so each keyword lookup
+    is a plain str.find per page instead of re-lowercasing the whole document per keyword.
+    """
+
+    def __init__(self, payloads):
+        self.pages = [
+            (str(page_ref), payload, payload.get('ocr_text', '').lower())
+            for page_ref, payload in payloads.items()
+        ]
+
+    def first_matches(self, keyword_lower):
+        """(page ref, payload, first match index) for every page containing the keyword."""
+        for page_ref, payload, text_lower in self.pages:
+            idx = text_lower.find(keyword_lower)
+            if idx != -1:
+                yield page_ref, payload, idx
+
+
+class MindMapCache:
+    """
+    Extracted structures and rendered HTML on disk, keyed by a hash of the document's page texts
+    plus the prompt version and model name. Re-indexing a changed PDF, editing the prompts or the
+    HTML template (bump config.MINDMAP_PROMPT_VERSION) or switching models changes the key, so
+    stale entries are never served and simply age out under the size cap.
+    """
+
+    def __init__(self, directory: str = config.MINDMAP_CACHE_DIR, max_bytes: int = config.MINDMAP_CACHE_MAX_BYTES):
+        self.structures = DiskCache(os.path.join(directory, "structures"), max_bytes=max_bytes, suffix=".json")
+        self.html = DiskCache(os.path.join(directory, "html"), max_bytes=max_bytes, suffix=".html")
+
+    @staticmethod
+    def document_key(payloads, model_name: str = "") -> str:
+        digest = hashlib.sha256(f"{config.MINDMAP_PROMPT_VERSION}\x00{model_name}".encode("utf-8"))
+        for page_ref, payload in sorted(payloads.items(), key=lambda item: (item[1].get('page_number', 0), str(item[0]))):
+            digest.update(f"\x00{page_ref}\x00{payload.get('page_number', '')}\x00".encode("utf-8"))
+            digest.update(payload.get('ocr_text', '').encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_structure(self, key: str):
+        data = self.structures.get(key)
+        return json.loads(data) if data is not None else None
+
+    def set_structure(self, key: str, structure: dict):
+        self.structures.set(key, json.dumps(structure, ensure_ascii=False).encode("utf-8"))
+
+    def get_html(self, key: str):
+        data = self.html.get(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def set_html(self, key: str, html: str):
+        self.html.set(key, html.encode("utf-8"))
+
+    def invalidate(self, key: str):
+        """Forget one document's structure and HTML (e.g. to force regeneration)."""
+        self.structures.delete(key)
+        self.html.delete(key)
 
 
 class RAGExtensions:
-    def __init__(self, rag_instance):
-        """Initialize extensions with existing RAG instance."""
+    def __init__(self, rag_instance, cache=None):
+        """
+        Initialize extensions with existing RAG instance.
+        `cache` is a MindMapCache; by default one under config.MINDMAP_CACHE_DIR (None when disabled).
+        """
         self.rag = rag_instance
+        if cache is None and config.MINDMAP_CACHE_ENABLED:
+            cache = MindMapCache()
+        self.cache = cache
         self.structure = None
         print("✅ RAG Extensions initialized")
 
-    def _find_keyword_locations(self, keyword):
-        """Find all pages where a keyword appears."""
+    def _find_keyword_locations(self, keyword, page_index):
+        """
+        Find all pages where a keyword appears.
+        Entries reference their page image by 'page_ref' (see _collect_page_images) instead of embedding it.
+        `page_index` is the PageTextIndex of the current payloads, shared across a mind map's keywords.
+        """
         locations = []
         keyword_lower = keyword.lower()
-        payloads = getattr(self.rag, 'payloads', {})
-        
-        for payload in payloads.values():
-            ocr_text = payload.get('ocr_text', '').lower()
-            if keyword_lower in ocr_text:
-                idx = ocr_text.find(keyword_lower)
-                start = max(0, idx - 75)
-                end = idx + len(keyword) + 75
-                context = f"...{payload.get('ocr_text', '')[start:end].replace(chr(10), ' ')}..."
-                locations.append({
-                    'page_number': payload.get('page_number', 'N/A'),
-                    'context': context,
-                    'page_image': payload.get('page_base64_image', '')
-                })
+        
+        for page_ref, payload, idx in page_index.first_matches(keyword_lower):
+            start = max(0, idx - 75)
+            end = idx + len(keyword) + 75
+            context = f"...{payload.get('ocr_text', '')[start:end].replace(chr(10), ' ')}..."
+            locations.append({
+                'page_number': payload.get('page_number', 'N/A'),
+                'context': context,
+                'page_ref': page_ref
+            })
         return sorted(locations, key=lambda x: x.get('page_number') or 0)
 
-    def _extract_important_points(self):
-        """Extract the most important points from the document using AI."""
+    STRUCTURE_SCHEMA = '''{
+  "document_title": "string",
+  "key_points": [
+    {
+      "title": "string",
+      "description": "string",
+      "subtopics": ["string"]
+    }
+  ]
+}'''
+
+    def _generate_structure(self, prompt):
+        """Run one JSON-mode extraction call; returns the parsed structure or None."""
+        response = self.rag.model.generate_content(
+            prompt,
+            generation_config={
+                "temperature": 0.1,
+                "response_mime_type": "application/json"
+            }
+        )
+        return json.loads(response.text)
+
+    def _extract_important_points(self, mode=None):
+        """
+        Extract the most important points from the document using AI.
+        mode="truncate" reads the first 30 pages / 20,000 characters in one call; mode="map_reduce"
+        covers every page in token-budgeted chunks. By default documents that fit the single-call
+        budget are truncated (no loss) and longer ones use map-reduce.
+        """
         print("🔍 Extracting important points from document...")
         payloads = getattr(self.rag, 'payloads', None)
         
@@ -45,22 +147,19 @@ class RAGExtensions:
             return None
 
         all_pages = sorted(payloads.values(), key=lambda x: x.get('page_number', 0))
+        if mode is None:
+            total_chars = sum(len(p.get('ocr_text', '')) + 2 for p in all_pages)
+            mode = "truncate" if len(all_pages) <= 30 and total_chars <= 20000 else "map_reduce"
+        if mode == "map_reduce":
+            return self._extract_important_points_map_reduce(all_pages)
+
         full_text = "\n\n".join(p.get('ocr_text', '') for p in all_pages[:30])
         
         if len(full_text) > 20000:
             full_text = full_text[:20000]
         
         extraction_prompt = f'''Analyze the document text to identify its core structure. Return ONLY a JSON object with this schema:
-{{
-  "document_title": "string",
-  "key_points": [
-    {{
-      "title": "string",
-      "description": "string",
-      "subtopics": ["string"]
-    }}
-  ]
-}}
+{self.STRUCTURE_SCHEMA}
 
 Rules:
 - "key_points" should be 5-8 main topics
@@ -70,25 +169,152 @@ Rules:
 Text: {full_text}'''
         
         try:
-            response = self.rag.model.generate_content(
-                extraction_prompt,
-                generation_config={
-                    "temperature": 0.1,
-                    "response_mime_type": "application/json"
-                }
-            )
-            structure = json.loads(response.text)
+            structure = self._generate_structure(extraction_prompt)
             print(f"✅ Extracted {len(structure.get('key_points', []))} key points")
             return structure
         except Exception as e:
             print(f"⚠️ AI extraction failed: {e}")
             return None
 
-    def generate_mind_map(self):
-        """Generate the complete HTML for an interactive mind map."""
-        structure = self._extract_important_points()
-        if not structure:
-            return "<div>Failed to generate structure.</div>"
+    @staticmethod
+    def _chunk_pages(pages, max_chars):
+        """Split the page list into consecutive chunks of at most max_chars of text (long pages are split)."""
+        chunks, current, current_len = [], [], 0
+        for page in pages:
+            text = page.get('ocr_text', '')
+            pieces = [text[i:i + max_chars] for i in range(0, len(text), max_chars)] or ['']
+            for piece in pieces:
+                if current and current_len + len(piece) > max_chars:
+                    chunks.append("\n\n".join(current))
+                    current, current_len = [], 0
+                current.append(piece)
+                current_len += len(piece) + 2
+        if current:
+            chunks.append("\n\n".join(current))
+        return [c for c in chunks if c.strip()]
+
+    def _extract_chunk_points(self, index, count, chunk_text):
+        prompt = f'''This is part {index + 1} of {count} of a longer document. Identify the main topics covered in THIS part. Return ONLY a JSON object with this schema:
+{self.STRUCTURE_SCHEMA}
+
+Rules:
+- "key_points" should be 2-6 topics for this part
+- "subtopics" should be 2-4 crucial details per point
+- Keep titles concise (max 60 characters)
+- "document_title" is your best guess of the whole document's title
+
+Text: {chunk_text}'''
+        try:
+            return self._generate_structure(prompt)
+        except Exception as e:
+            print(f"⚠️ Extraction failed for part {index + 1}/{count}: {e}")
+            return None
+
+    @staticmethod
+    def _merge_key_points(partials):
+        """Deduplicate key points by normalized title, merging descriptions and subtopics, in document order."""
+        merged = {}
+        for partial in partials:
+            for kp in partial.get("key_points", []) or []:
+                title = (kp.get("title") or "").strip()
+                if not title:
+                    continue
+                key = re.sub(r"\W+", " ", title.lower()).strip()
+                entry = merged.setdefault(key, {"title": title, "description": kp.get("description", ""),
+                                                "subtopics": [], "mentions": 0})
+                entry["mentions"] += 1
+                seen = {s.lower() for s in entry["subtopics"]}
+                for sub in kp.get("subtopics", []) or []:
+                    sub = (sub or "").strip()
+                    if sub and sub.lower() not in seen:
+                        entry["subtopics"].append(sub)
+                        seen.add(sub.lower())
+        return list(merged.values())
+
+    def _extract_important_points_map_reduce(self, all_pages):
+        """Map: extract key points per chunk concurrently. Reduce: merge, dedupe and condense to 5-8 topics."""
+        chunks = self._chunk_pages(all_pages, config.MINDMAP_CHUNK_TOKENS * 4)  # ~4 characters per token
+        if not chunks:
+            print("❌ No page text found")
+            return None
+        print(f"🗺️ Map-reduce extraction over {len(all_pages)} pages in {len(chunks)} chunks")
+        with ThreadPoolExecutor(max_workers=min(config.MINDMAP_MAX_WORKERS, len(chunks))) as pool:
+            partials = list(pool.map(lambda args: self._extract_chunk_points(args[0], len(chunks), args[1]),
+                                     enumerate(chunks)))
+        partials = [p for p in partials if p]
+        if not partials:
+            print("⚠️ AI extraction failed for every chunk")
+            return None
+
+        candidates = self._merge_key_points(partials)
+        titles = Counter(p.get("document_title", "").strip() for p in partials if p.get("document_title", "").strip())
+        # The first part usually holds the real title page; fall back to the most common guess
+        document_title = (partials[0].get("document_title") or "").strip() or \
+            (titles.most_common(1)[0][0] if titles else "Document")
+
+        if len(candidates) <= 8:
+            structure = {"document_title": document_title, "key_points": [
+                {"title": c["title"], "description": c["description"], "subtopics": c["subtopics"][:4]}
+                for c in candidates
+            ]}
+        else:
+            outline = json.dumps([
+                {"title": c["title"], "description": c["description"], "subtopics": c["subtopics"][:6]}
+                for c in candidates
+            ], ensure_ascii=False)
+            reduce_prompt = f'''Below are topics extracted, in order, from all parts of the document "{document_title}". Merge duplicates and overlapping topics and keep the most important ones. Return ONLY a JSON object with this schema:
+{self.STRUCTURE_SCHEMA}
+
+Rules:
+- "key_points" should be 5-8 main topics covering the whole document, in document order
+- "subtopics" should be 2-4 crucial details per point
+- Keep titles concise (max 60 characters)
+
+Topics: {outline}'''
+            try:
+                structure = self._generate_structure(reduce_prompt)
+                structure.setdefault("document_title", document_title)
+            except Exception as e:
+                print(f"⚠️ Reduce step failed, keeping the most mentioned topics: {e}")
+                top = sorted(candidates, key=lambda c: -c["mentions"])[:8]
+                top.sort(key=candidates.index)
+                structure = {"document_title": document_title, "key_points": [
+                    {"title": c["title"], "description": c["description"], "subtopics": c["subtopics"][:4]}
+                    for c in top
+                ]}
+        print(f"✅ Extracted {len(structure.get('key_points', []))} key points")
+        return structure
+
+    def _cache_key(self):
+        payloads = getattr(self.rag, 'payloads', None)
+        if self.cache is None or not payloads:
+            return None
+        model_name = getattr(getattr(self.rag, 'model', None), 'model_name', '') or ''
+        return MindMapCache.document_key(payloads, model_name)
+
+    def generate_mind_map(self, refresh=False):
+        """
+        Generate the complete HTML for an interactive mind map.
+        Served from the on-disk cache when this document was mapped before; refresh=True regenerates it.
+        """
+        cache_key = self._cache_key()
+        if cache_key is not None:
+            if refresh:
+                self.cache.invalidate(cache_key)
+            else:
+                html = self.cache.get_html(cache_key)
+                if html is not None:
+                    print("⚡ Mind map served from cache")
+                    return html
+
+        structure = self.cache.get_structure(cache_key) if cache_key is not None else None
+        if structure is None:
+            structure = self._extract_important_points()
+            if not structure:
+                return MINDMAP_FAILURE_HTML
+            if cache_key is not None:
+                self.cache.set_structure(cache_key, structure)
+        self.structure = structure
 
         print("🎨 Building organized mind map...")
         
@@ -134,19 +360,42 @@ Text: {full_text}'''
                 })
                 edges.append({"from": kp_id, "to": st_id})
         
+        # Built once per mind map from the current payloads, so it always matches the document
+        page_index = PageTextIndex(getattr(self.rag, 'payloads', {}) or {})
         location_data = {
-            n['id']: self._find_keyword_locations(n['keyword']) 
+            n['id']: self._find_keyword_locations(n['keyword'], page_index)
             for n in nodes if n.get('keyword')
         }
+        page_images = self._collect_page_images(location_data)
         
         print(f"✅ Mind map ready with {len(nodes)} nodes")
-        return self._generate_mindmap_html(nodes, edges, location_data)
+        html = self._generate_mindmap_html(nodes, edges, location_data, page_images)
+        if cache_key is not None:
+            self.cache.set_html(cache_key, html)
+        return html
 
-    def _generate_mindmap_html(self, nodes, edges, location_data):
+    def _collect_page_images(self, location_data):
+        """One data URI per referenced page, however many nodes mention it, downscaled to a panel-sized thumbnail."""
+        payloads = getattr(self.rag, 'payloads', {}) or {}
+        by_ref = {str(ref): payload for ref, payload in payloads.items()}
+        page_images = {}
+        for locations in location_data.values():
+            for loc in locations:
+                ref = loc['page_ref']
+                if ref in page_images:
+                    continue
+                image_b64 = by_ref.get(ref, {}).get('page_base64_image', '')
+                if image_b64 and config.MINDMAP_IMAGE_MAX_DIM:
+                    image_b64 = thumbnail_base64(image_b64, config.MINDMAP_IMAGE_MAX_DIM)
+                page_images[ref] = base64_data_uri(image_b64)
+        return page_images
+
+    def _generate_mindmap_html(self, nodes, edges, location_data, page_images=None):
         """Generate the complete HTML for the mind map visualization."""
         nodes_json = json.dumps(nodes)
         edges_json = json.dumps(edges)
         location_json = json.dumps(location_data)
+        page_images_json = json.dumps(page_images or {})
         
         html = f"""<!DOCTYPE html>
 <html>
@@ -175,6 +424,18 @@ Text: {full_text}'''
         }}
         #canvas:active {{ cursor: grabbing; }}
         
+        #viewport {{
+            position: absolute;
+            top: 0;
+            left: 0;
+            width: 100%;
+            height: 100%;
+            transform-origin: 0 0;
+            will-change: transform;
+        }}
+        
+        .hidden {{ display: none; }}
+        
         .node {{
             position: absolute;
             padding: 12px 20px;
@@ -182,7 +443,8 @@ Text: {full_text}'''
             border: 2px solid #374151;
             border-radius: 10px;
             cursor: pointer;
-            transition: all 0.3s ease;
+            transform: translate(-50%, -50%);
+            transition: transform 0.3s ease, border-color 0.3s ease, box-shadow 0.3s ease;
             font-size: 14px;
             white-space: nowrap;
             box-shadow: 0 4px 12px rgba(0, 0, 0, 0.4);
@@ -194,7 +456,7 @@ Text: {full_text}'''
         }}
         
         .node:hover {{
-            transform: scale(1.05);
+            transform: translate(-50%, -50%) scale(1.05);
             border-color: #4a9eff;
             z-index: 1000;
             box-shadow: 0 6px 20px rgba(74, 158, 255, 0.4);
@@ -245,6 +507,7 @@ Text: {full_text}'''
             left: 0;
             width: 100%;
             height: 100%;
+            overflow: visible;
             pointer-events: none;
             z-index: 0;
         }}
@@ -347,8 +610,10 @@ Text: {full_text}'''
         </div>
         <div class="info-panel" id="info-panel"></div>
         <div id="canvas">
-            <svg id="edges"></svg>
-            <div id="nodes-container"></div>
+            <div id="viewport">
+                <svg id="edges"></svg>
+                <div id="nodes-container"></div>
+            </div>
         </div>
     </div>
     
@@ -356,28 +621,40 @@ Text: {full_text}'''
         const nodesData = {nodes_json};
         const edgesData = {edges_json};
         const locationData = {location_json};
+        const pageImages = {page_images_json};
+        
+        // Lookup tables built once: O(1) parent/children/node access instead of scanning edgesData
+        const nodeById = {{}};
+        const childrenOf = {{}};
+        const parentOf = {{}};
+        nodesData.forEach(n => {{
+            nodeById[n.id] = n;
+            childrenOf[n.id] = [];
+        }});
+        edgesData.forEach(e => {{
+            if (childrenOf[e.from]) childrenOf[e.from].push(e.to);
+            if (!(e.to in parentOf)) parentOf[e.to] = e.from;
+        }});
+        const roots = nodesData.filter(n => !(n.id in parentOf)).map(n => n.id);
         
         let positions = {{}};
         let scale = 1;
         let offsetX = 0;
         let offsetY = 0;
         let collapsedNodes = new Set();
+        let visibleNodes = new Set();
         
         // Initialize - collapse all except root
         nodesData.forEach(n => {{
             if (n.level > 0) collapsedNodes.add(n.id);
         }});
         
-        function getChildrenIds(nodeId) {{
-            return edgesData.filter(e => e.from === nodeId).map(e => e.to);
-        }}
-        
-        function isNodeVisible(nodeId) {{
-            const edge = edgesData.find(e => e.to === nodeId);
-            if (!edge) return true;
-            if (collapsedNodes.has(edge.from)) return false;
-            return isNodeVisible(edge.from);
-        }}
+        const viewport = document.getElementById('viewport');
+        const nodesContainer = document.getElementById('nodes-container');
+        const edgesSvg = document.getElementById('edges');
+        const nodeEls = {{}};
+        const iconEls = {{}};
+        const edgeEls = [];
         
         function calculateLayout() {{
             const centerX = window.innerWidth / 2;
@@ -403,9 +680,7 @@ Text: {full_text}'''
             const level2Radius = Math.min(centerX, centerY) * 0.8;
             
             level1Nodes.forEach(parentNode => {{
-                const children = edgesData
-                    .filter(e => e.from === parentNode.id)
-                    .map(e => e.to);
+                const children = childrenOf[parentNode.id];
                 
                 if (children.length === 0) return;
                 
@@ -431,54 +706,23 @@ Text: {full_text}'''
             }});
         }}
         
-        function render() {{
-            const nodesContainer = document.getElementById('nodes-container');
-            const edgesSvg = document.getElementById('edges');
-            
-            nodesContainer.innerHTML = '';
-            edgesSvg.innerHTML = '';
-            
-            // Render edges
+        // DOM elements are created once; later updates only move, show or hide them
+        function buildElements() {{
             edgesData.forEach(edge => {{
-                if (!isNodeVisible(edge.to)) return;
-                
-                const fromPos = positions[edge.from];
-                const toPos = positions[edge.to];
-                
-                if (!fromPos || !toPos) return;
-                
-                const x1 = fromPos.x * scale + offsetX;
-                const y1 = fromPos.y * scale + offsetY;
-                const x2 = toPos.x * scale + offsetX;
-                const y2 = toPos.y * scale + offsetY;
-                
                 const path = document.createElementNS('http://www.w3.org/2000/svg', 'path');
                 path.setAttribute('class', 'edge');
-                path.setAttribute('d', `M ${{x1}},${{y1}} L ${{x2}},${{y2}}`);
                 edgesSvg.appendChild(path);
+                edgeEls.push({{ edge, el: path }});
             }});
             
-            // Render nodes
             nodesData.forEach(node => {{
-                if (!isNodeVisible(node.id)) return;
-                
-                const pos = positions[node.id];
-                if (!pos) return;
-                
                 const nodeEl = document.createElement('div');
                 nodeEl.className = `node ${{node.type}}`;
                 nodeEl.onclick = () => showNodeInfo(node.id);
                 
-                const children = getChildrenIds(node.id);
-                
                 const icon = document.createElement('span');
-                icon.className = `expand-icon ${{
-                    children.length > 0 
-                        ? (collapsedNodes.has(node.id) ? 'collapsed' : 'expanded')
-                        : 'leaf'
-                }}`;
-                
-                if (children.length > 0) {{
+                icon.className = 'expand-icon';
+                if (childrenOf[node.id].length > 0) {{
                     icon.onclick = (e) => {{
                         e.stopPropagation();
                         toggleNodeCollapse(node.id);
@@ -490,38 +734,94 @@ Text: {full_text}'''
                 
                 nodeEl.appendChild(icon);
                 nodeEl.appendChild(label);
-                
-                nodeEl.style.left = `${{pos.x * scale + offsetX}}px`;
-                nodeEl.style.top = `${{pos.y * scale + offsetY}}px`;
-                nodeEl.style.transform = 'translate(-50%, -50%)';
-                
                 nodesContainer.appendChild(nodeEl);
+                nodeEls[node.id] = nodeEl;
+                iconEls[node.id] = icon;
+            }});
+        }}
+        
+        // Layout coordinates only change on resize; pan/zoom never touches these
+        function positionElements() {{
+            edgeEls.forEach(({{ edge, el }}) => {{
+                const fromPos = positions[edge.from];
+                const toPos = positions[edge.to];
+                if (!fromPos || !toPos) return;
+                el.setAttribute('d', `M ${{fromPos.x}},${{fromPos.y}} L ${{toPos.x}},${{toPos.y}}`);
+            }});
+            
+            nodesData.forEach(node => {{
+                const pos = positions[node.id];
+                if (!pos) return;
+                nodeEls[node.id].style.left = `${{pos.x}}px`;
+                nodeEls[node.id].style.top = `${{pos.y}}px`;
             }});
         }}
         
+        // One walk from the roots: a node is visible when every ancestor is expanded
+        function updateVisibility() {{
+            visibleNodes = new Set();
+            const stack = roots.slice();
+            while (stack.length) {{
+                const id = stack.pop();
+                if (visibleNodes.has(id)) continue;
+                visibleNodes.add(id);
+                if (!collapsedNodes.has(id)) stack.push(...childrenOf[id]);
+            }}
+            
+            nodesData.forEach(node => {{
+                const visible = visibleNodes.has(node.id) && !!positions[node.id];
+                nodeEls[node.id].classList.toggle('hidden', !visible);
+                const hasChildren = childrenOf[node.id].length > 0;
+                iconEls[node.id].className = `expand-icon ${{
+                    hasChildren
+                        ? (collapsedNodes.has(node.id) ? 'collapsed' : 'expanded')
+                        : 'leaf'
+                }}`;
+            }});
+            
+            edgeEls.forEach(({{ edge, el }}) => {{
+                const visible = visibleNodes.has(edge.to) && visibleNodes.has(edge.from);
+                el.classList.toggle('hidden', !visible);
+            }});
+        }}
+        
+        // Pan & zoom are a single CSS transform on the viewport, applied at most once per frame
+        let frameRequested = false;
+        
+        function applyTransform() {{
+            frameRequested = false;
+            viewport.style.transform = `translate(${{offsetX}}px, ${{offsetY}}px) scale(${{scale}})`;
+        }}
+        
+        function scheduleTransform() {{
+            if (frameRequested) return;
+            frameRequested = true;
+            requestAnimationFrame(applyTransform);
+        }}
+        
         function toggleNodeCollapse(nodeId) {{
             if (collapsedNodes.has(nodeId)) {{
                 collapsedNodes.delete(nodeId);
             }} else {{
                 collapsedNodes.add(nodeId);
             }}
-            render();
+            updateVisibility();
         }}
         
         function expandAll() {{
             collapsedNodes.clear();
-            render();
+            updateVisibility();
         }}
         
         function collapseAll() {{
             nodesData.forEach(n => {{
                 if (n.level > 0) collapsedNodes.add(n.id);
             }});
-            render();
+            updateVisibility();
         }}
         
         function showNodeInfo(nodeId) {{
-            const node = nodesData.find(n => n.id === nodeId);
+            const node = nodeById[nodeId];
             if (!node) return;
             
             const panel = document.getElementById('info-panel');
@@ -534,8 +834,9 @@ Text: {full_text}'''
                     html += `<div class="location-item">
                         <strong>Page ${{loc.page_number}}</strong>
                         <p>${{loc.context}}</p>`;
-                    if (loc.page_image) {{
-                        html += `<img src="data:image/png;base64,${{loc.page_image}}">`;
+                    const pageImage = pageImages[loc.page_ref];
+                    if (pageImage) {{
+                        html += `<img src="${{pageImage}}">`;
                     }}
                     html += '</div>';
                 }});
@@ -549,7 +850,7 @@ Text: {full_text}'''
             scale = 1;
             offsetX = 0;
             offsetY = 0;
-            render();
+            scheduleTransform();
         }}
         
         // Pan & Zoom Controls
@@ -561,9 +862,7 @@ Text: {full_text}'''
         let initialOffsetY = 0;
         
         canvas.addEventListener('mousedown', (e) => {{
-            if (e.target !== canvas && 
-                e.target.id !== 'nodes-container' && 
-                e.target.id !== 'edges') return;
+            if (e.target.closest('.node')) return;
             
             isDragging = true;
             startX = e.clientX;
@@ -577,7 +876,7 @@ Text: {full_text}'''
             
             offsetX = initialOffsetX + (e.clientX - startX);
             offsetY = initialOffsetY + (e.clientY - startY);
-            render();
+            scheduleTransform();
         }});
         
         canvas.addEventListener('mouseup', () => {{
@@ -596,23 +895,26 @@ Text: {full_text}'''
             const mouseY = e.clientY - rect.top;
             
             const zoomFactor = 1.1;
-            const newScale = e.deltaY < 0 ? scale * zoomFactor : scale / zoomFactor;
+            const newScale = Math.max(0.1, Math.min(3, e.deltaY < 0 ? scale * zoomFactor : scale / zoomFactor));
             
             // Zoom toward mouse position
             offsetX = mouseX - (mouseX - offsetX) * (newScale / scale);
             offsetY = mouseY - (mouseY - offsetY) * (newScale / scale);
             
-            scale = Math.max(0.1, Math.min(3, newScale));
-            render();
-        }});
+            scale = newScale;
+            scheduleTransform();
+        }}, {{ passive: false }});
         
         // Initialize
+        buildElements();
         calculateLayout();
-        render();
+        positionElements();
+        updateVisibility();
+        applyTransform();
         
         window.addEventListener('resize', () => {{
             calculateLayout();
-            render();
+            positionElements();
         }});
     </script>
 </body>
@@ -0,0 +1,96 @@
+# modules/artifacts.py
+"""
+Per-session, per-turn file paths for generated audio/video, with disk-usage tracking
+and eviction of old artifacts (least recently used / older than max_age) under a quota.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+import config
+
+
+class ArtifactStore:
+    """
+    Layout: <root>/<session_id>/<turn>_<name>. Paths never collide between sessions or turns.
+    Call register() once a file has been written so it counts towards the quota.
+    """
+
+    def __init__(self, root: str = config.ARTIFACT_DIR, max_bytes: int = config.ARTIFACT_MAX_BYTES,
+                 max_age: float = config.ARTIFACT_MAX_AGE):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._files = {}  # path -> [size, last_used]
+        self._total_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                self._files[path] = [stat.st_size, stat.st_mtime]
+                self._total_bytes += stat.st_size
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    def path_for(self, session_id: str, turn: int, name: str) -> str:
+        """A fresh path for this session's turn, e.g. path_for(sid, 3, "answer.wav")."""
+        session_dir = os.path.join(self.root, session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        return os.path.join(session_dir, f"{turn:05d}_{name}")
+
+    def register(self, path: str):
+        """Account for a written artifact and evict old ones if the quota is exceeded."""
+        size = os.path.getsize(path)
+        now = time.time()
+        with self._lock:
+            self._total_bytes += size - self._files.get(path, [0])[0]
+            self._files[path] = [size, now]
+            self._evict(now, keep=path)
+
+    def touch(self, path: str):
+        """Mark an artifact as recently used (e.g. when it is replayed)."""
+        with self._lock:
+            if path in self._files:
+                self._files[path][1] = time.time()
+
+    def _remove(self, path: str):
+        """Delete one artifact; caller holds the lock."""
+        size = self._files.pop(path, [0])[0]
+        self._total_bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, now: float, keep: str = None):
+        """Drop expired artifacts, then least recently used ones until under the quota; caller holds the lock."""
+        if self.max_age is not None:
+            for path in [p for p, (_, used) in self._files.items() if now - used > self.max_age and p != keep]:
+                self._remove(path)
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+        for path in sorted(self._files, key=lambda p: self._files[p][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path != keep:
+                self._remove(path)
+
+    def delete_session(self, session_id: str):
+        """Remove every artifact of a session."""
+        session_dir = os.path.join(self.root, session_id)
+        with self._lock:
+            for path in [p for p in self._files if os.path.dirname(p) == session_dir]:
+                self._remove(path)
+        shutil.rmtree(session_dir, ignore_errors=True)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._files)
@@ -0,0 +1,47 @@
+# modules/audio.py
+"""
+In-process WAV packaging for the raw PCM returned by Gemini TTS.
+A 44-byte RIFF header is written in front of a memoryview of the PCM:
+no re-encode, no ffmpeg, no temp file.
+"""
+import struct
+
+# Gemini TTS output format
+SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2  # 16-bit
+CHANNELS = 1
+
+
+def wav_header(data_size: int, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+               sample_width: int = SAMPLE_WIDTH) -> bytes:
+    """Canonical 44-byte PCM WAV header for `data_size` bytes of samples."""
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+        b"data", data_size,
+    )
+
+
+def pcm_to_wav(pcm, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+               sample_width: int = SAMPLE_WIDTH) -> bytes:
+    """WAV bytes ready for st.audio(); the PCM is copied exactly once, into the result."""
+    view = memoryview(pcm)
+    return b"".join((wav_header(view.nbytes, sample_rate, channels, sample_width), view))
+
+
+def write_wav(path: str, pcm, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+              sample_width: int = SAMPLE_WIDTH) -> str:
+    """Write header + PCM straight to a file (no intermediate buffer); returns the path."""
+    view = memoryview(pcm)
+    with open(path, "wb") as f:
+        f.write(wav_header(view.nbytes, sample_rate, channels, sample_width))
+        f.write(view)
+    return path
+
+
+def pcm_duration(pcm, sample_rate: int = SAMPLE_RATE, channels: int = CHANNELS,
+                 sample_width: int = SAMPLE_WIDTH) -> float:
+    """Length of the PCM in seconds."""
+    return memoryview(pcm).nbytes / (sample_rate * channels * sample_width)
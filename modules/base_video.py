@@ -0,0 +1,196 @@
+# modules/base_video.py
+"""
+Precomputed frames and face detections for the fixed lip-sync base video.
+The base video is decoded once, its face boxes are detected once, and frames, boxes
+and resized face crops are stored as memory-mapped .npy files. Every LipSync.sync call
+then reuses them, leaving only the mel features and the Wav2Lip forward pass per request.
+"""
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+import config
+
+
+class BaseVideoCache:
+    def __init__(self, video_path: str, cache_dir: str = config.BASE_VIDEO_CACHE_DIR, img_size: int = 96):
+        self.video_path = video_path
+        self.img_size = img_size
+        stat = os.stat(video_path)
+        key = f"{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime_ns}:{img_size}"
+        self.directory = os.path.join(cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()[:16])
+        self.frames = None  # (N, H, W, 3) uint8, memory-mapped
+        self.boxes = None   # (N, 4) int32 as (y1, y2, x1, x2)
+        self.faces = None   # (N, img_size, img_size, 3) uint8, memory-mapped
+        self.fps = None
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.faces is not None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load_frames(self):
+        """Decode the base video into frames.npy on first use, otherwise memory-map it."""
+        with self._lock:
+            if self.frames is not None:
+                return self.frames
+            start = time.time()
+            if os.path.exists(self._file("frames.json")):
+                self._load_frames()
+                self.stats["frames_cold"] = False
+            else:
+                self._decode()
+                self.stats["frames_cold"] = True
+            self.stats["frames_seconds"] = time.time() - start
+            self.stats["frames"] = len(self.frames)
+            return self.frames
+
+    def warm_up(self, lipsync) -> dict:
+        """
+        Load the cache from disk, or build it (decode + face detection with the LipSync
+        instance's own detector) on first use. Returns timing stats.
+        """
+        self.load_frames()
+        with self._lock:
+            if self.ready:
+                return self.stats
+            start = time.time()
+            if os.path.exists(self._file("faces.json")):
+                self._load_faces()
+                self.stats["faces_cold"] = False
+            else:
+                self._detect(lipsync)
+                self.stats["faces_cold"] = True
+            self.stats["faces_seconds"] = time.time() - start
+            print(f"🎞️ Base video cache ready: frames {self.stats['frames_seconds']:.2f}s "
+                  f"({'decoded' if self.stats['frames_cold'] else 'mapped'}), faces {self.stats['faces_seconds']:.2f}s "
+                  f"({'detected' if self.stats['faces_cold'] else 'mapped'}), {self.stats['frames']} frames")
+            return self.stats
+
+    def _load_frames(self):
+        with open(self._file("frames.json"), "r", encoding="utf-8") as f:
+            self.fps = json.load(f)["fps"]
+        self.frames = np.load(self._file("frames.npy"), mmap_mode="r")
+
+    def _load_faces(self):
+        self.boxes = np.load(self._file("boxes.npy"))
+        self.faces = np.load(self._file("faces.npy"), mmap_mode="r")
+
+    def _decode(self):
+        os.makedirs(self.directory, exist_ok=True)
+        capture = cv2.VideoCapture(self.video_path)
+        fps = capture.get(cv2.CAP_PROP_FPS) or config.LIPSYNC_FPS
+        n_frames = 0
+        while capture.grab():
+            n_frames += 1
+        capture.release()
+        if n_frames == 0:
+            raise RuntimeError(f"Could not decode any frame from {self.video_path}")
+
+        capture = cv2.VideoCapture(self.video_path)
+        ok, frame = capture.read()
+        frames = np.lib.format.open_memmap(self._file("frames.npy"), mode="w+", dtype=np.uint8,
+                                           shape=(n_frames,) + frame.shape)
+        index = 0
+        while ok and index < n_frames:
+            frames[index] = frame
+            index += 1
+            ok, frame = capture.read()
+        capture.release()
+        frames.flush()
+        del frames
+        # The .json marker is written last: its presence means the array is complete
+        with open(self._file("frames.json"), "w", encoding="utf-8") as f:
+            json.dump({"fps": fps, "frames": n_frames}, f)
+        self._load_frames()
+
+    def _detect(self, lipsync):
+        n_frames = len(self.frames)
+        detections = lipsync.face_detect([self.frames[i] for i in range(n_frames)])
+        faces = np.lib.format.open_memmap(self._file("faces.npy"), mode="w+", dtype=np.uint8,
+                                          shape=(n_frames, self.img_size, self.img_size, 3))
+        for i, (crop, _) in enumerate(detections):
+            faces[i] = cv2.resize(crop, (self.img_size, self.img_size))
+        faces.flush()
+        del faces
+        np.save(self._file("boxes.npy"), np.array([coords for _, coords in detections], dtype=np.int32))
+        with open(self._file("faces.json"), "w", encoding="utf-8") as f:
+            json.dump({"frames": n_frames, "img_size": self.img_size}, f)
+        self._load_faces()
+
+    def base_index(self, i: int) -> int:
+        """
+        Base frame shown at output frame i: forward, then backward, then forward again
+        (ping-pong), so looping never jumps from the last frame back to the first.
+        """
+        n_frames = len(self.frames)
+        if n_frames == 1:
+            return 0
+        period = 2 * n_frames - 2
+        j = i % period
+        return j if j < n_frames else period - j
+
+    def frames_needed(self, duration_seconds: float) -> int:
+        """Frame count for an answer of this length, rounded up to whole seconds so clips get reused."""
+        fps = self.fps or config.LIPSYNC_FPS
+        return max(1, int(math.ceil(max(duration_seconds, 0.0) + 1e-6)) * int(round(fps)))
+
+    def write_clip(self, n_frames: int) -> str:
+        """
+        Write (once) a clip of exactly n_frames cached base frames, looped ping-pong if the
+        answer is longer than the base video, and return its path for LipSync.sync.
+        """
+        self.load_frames()
+        # The name is unique per base video: LipSync's own detection cache is keyed by file name
+        path = self._file(f"clip_{os.path.basename(self.directory)}_{n_frames}.mp4")
+        if os.path.exists(path):
+            return path
+        height, width = self.frames.shape[1:3]
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".mp4")
+        os.close(fd)
+        writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (width, height))
+        try:
+            for i in range(n_frames):
+                writer.write(np.ascontiguousarray(self.frames[self.base_index(i)]))
+        finally:
+            writer.release()
+        os.replace(tmp_path, path)
+        return path
+
+    def face_detect(self, images) -> list:
+        """Drop-in for LipSync.face_detect: cached [face_crop, (y1, y2, x1, x2)] per output frame."""
+        detections = []
+        for i in range(len(images)):
+            j = self.base_index(i)
+            detections.append([np.asarray(self.faces[j]), tuple(int(v) for v in self.boxes[j])])
+        return detections
+
+    def matches(self, first_frame) -> bool:
+        """True if a decoded frame is the base video's first frame (tolerating re-encoding noise)."""
+        first_frame = np.asarray(first_frame)
+        if first_frame.shape != self.frames.shape[1:]:
+            return False
+        difference = np.abs(first_frame[::8, ::8].astype(np.int16) - self.frames[0][::8, ::8].astype(np.int16))
+        return float(difference.mean()) < 8.0
+
+    def install(self, lipsync):
+        """Make a LipSync instance use the cached detections for the base video and clips cut from it."""
+        self.warm_up(lipsync)
+        original = lipsync.face_detect
+
+        def face_detect(images):
+            if len(images) and self.matches(images[0]):
+                return self.face_detect(images)
+            return original(images)  # some other video: detect as usual
+
+        lipsync.face_detect = face_detect
+        return lipsync
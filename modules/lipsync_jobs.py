@@ -0,0 +1,183 @@
+# modules/lipsync_jobs.py
+"""
+Background lip-sync rendering.
+Jobs are queued on a bounded worker pool (one LipSync instance per worker thread),
+polled by ID for status/progress, can be cancelled, and finished videos are cached
+by (audio hash, base video, checkpoint) so identical answers are never re-rendered.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import config
+from modules.utils import DiskCache, file_sha256
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class LipSyncJob:
+    def __init__(self, job_id: str, base_video_path: str, audio_path: str, output_path: str, cache_key: str):
+        self.id = job_id
+        self.base_video_path = base_video_path
+        self.audio_path = audio_path
+        self.output_path = output_path
+        self.cache_key = cache_key
+        self.state = QUEUED
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.from_cache = False
+        self.cold_start = False
+        self.future = None
+
+
+class LipSyncJobQueue:
+    """
+    Runs LipSync.sync jobs off the Streamlit script thread.
+    `lipsync_factory()` builds a LipSync instance; each worker thread gets its own,
+    so `max_workers` caps the number of concurrent renders.
+    """
+
+    def __init__(self, lipsync_factory, checkpoint_path: str,
+                 max_workers: int = config.LIPSYNC_MAX_CONCURRENT,
+                 cache_dir: str = config.LIPSYNC_RESULT_CACHE_DIR,
+                 cache_max_bytes: int = config.LIPSYNC_RESULT_CACHE_MAX_BYTES,
+                 max_finished_jobs: int = 256):
+        self.lipsync_factory = lipsync_factory
+        self.checkpoint_path = checkpoint_path
+        self.max_finished_jobs = max_finished_jobs
+        self.cache = DiskCache(cache_dir, max_bytes=cache_max_bytes, suffix=".mp4") if cache_dir else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lipsync")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._render_times = []
+
+    def _lipsync(self):
+        if getattr(self._local, "lipsync", None) is None:
+            self._local.lipsync = self.lipsync_factory()
+        return self._local.lipsync
+
+    def cache_key(self, base_video_path: str, audio_path: str) -> str:
+        base_stat = os.stat(base_video_path)
+        return (f"{file_sha256(audio_path)}:{os.path.abspath(base_video_path)}:"
+                f"{base_stat.st_size}:{base_stat.st_mtime_ns}:{os.path.abspath(self.checkpoint_path)}")
+
+    def submit(self, base_video_path: str, audio_path: str, output_path: str) -> str:
+        """Queue a render and return its job ID (finished immediately on a cache hit)."""
+        key = self.cache_key(base_video_path, audio_path)
+        job = LipSyncJob(uuid.uuid4().hex, base_video_path, audio_path, output_path, key)
+        cached_path = self.cache.path(key) if self.cache is not None else None
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        if cached_path is not None:
+            try:
+                shutil.copyfile(cached_path, output_path)
+                job.state = DONE
+                job.from_cache = True
+                job.started_at = job.finished_at = time.time()
+                return job.id
+            except FileNotFoundError:
+                pass  # evicted in the meantime; render it
+        job.future = self._executor.submit(self._run, job)
+        return job.id
+
+    def _run(self, job: LipSyncJob):
+        if job.cancel_requested:
+            job.state = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.state = RUNNING
+        job.started_at = time.time()
+        try:
+            job.cold_start = getattr(self._local, "lipsync", None) is None  # model load + base-video warm-up
+            self._lipsync().sync(job.base_video_path, job.audio_path, job.output_path)
+            if not os.path.exists(job.output_path):
+                raise RuntimeError("LipSync finished without writing the output video")
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+            job.finished_at = time.time()
+            return
+        job.finished_at = time.time()
+        with self._lock:
+            if not job.cold_start:
+                self._render_times = (self._render_times + [job.finished_at - job.started_at])[-20:]
+        if job.cancel_requested:
+            # Cannot interrupt a running render; discard its result instead
+            job.state = CANCELLED
+            return
+        if self.cache is not None:
+            with open(job.output_path, "rb") as f:
+                self.cache.set(job.cache_key, f.read())
+        job.state = DONE
+
+    def _forget_old_jobs(self):
+        """Keep the job table bounded; caller holds the lock."""
+        finished = [j for j in self._jobs.values() if j.state in FINISHED_STATES]
+        for job in sorted(finished, key=lambda j: j.submitted_at)[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job.id]
+
+    def status(self, job_id: str) -> dict:
+        """Snapshot of a job: state, progress in [0, 1], timings, output path and error."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown lip-sync job: {job_id}")
+        now = time.time()
+        if job.state == DONE:
+            progress = 1.0
+        elif job.state == RUNNING:
+            # Estimated from recent render times; LipSync itself does not report progress
+            with self._lock:
+                average = sum(self._render_times) / len(self._render_times) if self._render_times else None
+            progress = min(0.95, (now - job.started_at) / average) if average else 0.1
+        else:
+            progress = 0.0
+        with self._lock:
+            queue_position = sum(1 for j in self._jobs.values()
+                                 if j.state == QUEUED and j.submitted_at < job.submitted_at)
+        return {
+            "id": job.id,
+            "state": job.state,
+            "progress": progress,
+            "queue_position": queue_position if job.state == QUEUED else 0,
+            "elapsed": (job.finished_at or now) - job.submitted_at,
+            "render_time": (job.finished_at - job.started_at) if job.finished_at and job.started_at else None,
+            "from_cache": job.from_cache,
+            "cold_start": job.cold_start,
+            "output_path": job.output_path if job.state == DONE else None,
+            "error": job.error,
+        }
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job. Queued jobs never start; a running render finishes but its result is discarded."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return False
+        job.cancel_requested = True
+        if job.future is not None and job.future.cancel():
+            job.state = CANCELLED
+            job.finished_at = time.time()
+        return True
+
+    def wait(self, job_id: str, poll_interval: float = 0.5, timeout: float = None) -> dict:
+        """Block until the job finishes (or the timeout passes) and return its status."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            status = self.status(job_id)
+            if status["state"] in FINISHED_STATES or (deadline is not None and time.time() >= deadline):
+                return status
+            time.sleep(poll_interval)
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,160 @@
+# modules/local_retrieval.py
+"""
+In-process ColPali retrieval: late-interaction (MaxSim) scoring of precomputed multi-vector
+page embeddings with NumPy, answered by the local Chatbot. LocalColPaliRAG follows
+ColPaliRAG.query's contract, so the app can use it in place of the Colab backend.
+"""
+import hashlib
+import json
+import numpy as np
+import config
+from modules.chatbot import Chatbot
+from modules.multivector_index import MultiVectorIndex
+from modules.rag_colpali import ColPaliRAG, QueryCache
+
+
+class InMemoryPageIndex:
+    """
+    Page embeddings padded into one (pages, max_tokens, dim) float32 tensor with a token mask.
+    MaxSim for all pages is a handful of batched matmuls: for every query token, the best
+    matching patch of each page, summed over query tokens.
+    """
+
+    def __init__(self, page_embeddings: list, pages: list, batch_pages: int = config.LOCAL_SCORE_BATCH_PAGES):
+        if len(page_embeddings) != len(pages):
+            raise ValueError("page_embeddings and pages must have the same length")
+        self.pages = pages
+        self.batch_pages = batch_pages
+        lengths = [len(e) for e in page_embeddings]
+        dim = page_embeddings[0].shape[1] if page_embeddings else 0
+        self.vectors = np.zeros((len(page_embeddings), max(lengths, default=0), dim), dtype=np.float32)
+        self.mask = np.zeros(self.vectors.shape[:2], dtype=bool)
+        for i, embedding in enumerate(page_embeddings):
+            self.vectors[i, :lengths[i]] = embedding
+            self.mask[i, :lengths[i]] = True
+        digest = hashlib.sha256(self.vectors.tobytes())
+        digest.update(json.dumps([p.get("page_number") for p in pages]).encode("utf-8"))
+        self.fingerprint = digest.hexdigest()[:16]
+
+    @classmethod
+    def from_npz(cls, path: str, **kwargs):
+        """
+        Load an .npz with `embeddings` (all patch vectors concatenated, float), `offsets`
+        (pages + 1 row boundaries) and `pages` (JSON string of the page metadata list).
+        """
+        with np.load(path) as data:
+            embeddings = data["embeddings"].astype(np.float32)
+            offsets = data["offsets"]
+            pages = json.loads(str(data["pages"]))
+        return cls([embeddings[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)], pages, **kwargs)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def page(self, page_idx: int) -> dict:
+        return self.pages[page_idx]
+
+    def scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """MaxSim score of every page for one query, shape (pages,)."""
+        query = np.asarray(query_embeddings, dtype=np.float32)
+        scores = np.empty(len(self.pages), dtype=np.float32)
+        for start in range(0, len(self.pages), self.batch_pages):
+            stop = start + self.batch_pages
+            similarity = self.vectors[start:stop] @ query.T                  # (batch, tokens, query tokens)
+            similarity[~self.mask[start:stop]] = -np.inf                     # padding never wins the max
+            scores[start:stop] = similarity.max(axis=1).sum(axis=1)
+        return scores
+
+    def search(self, query_embeddings: np.ndarray, k: int) -> list:
+        """Top-k (page index, score) pairs, best first."""
+        scores = self.scores(query_embeddings)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+class ColPaliQueryEncoder:
+    """Query-side ColPali embeddings (requires the optional colpali-engine / torch install)."""
+
+    def __init__(self, model_name: str = config.COLPALI_MODEL, device: str = None):
+        try:
+            import torch
+            from colpali_engine.models import ColPali, ColPaliProcessor
+        except ImportError as e:
+            raise ImportError("Local query encoding needs colpali-engine and torch installed") from e
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = ColPali.from_pretrained(model_name).to(self.device).eval()
+        self.processor = ColPaliProcessor.from_pretrained(model_name)
+
+    def encode(self, query_text: str) -> np.ndarray:
+        batch = self.processor.process_queries([query_text]).to(self.device)
+        with self.torch.no_grad():
+            embeddings = self.model(**batch)
+        return embeddings[0].float().cpu().numpy()
+
+
+class LocalColPaliRAG:
+    """
+    Drop-in for ColPaliRAG's chat path over an InMemoryPageIndex or a MultiVectorIndex:
+    query() returns {"answer", "retrieved"} with the same citation fields. Scores are mean
+    MaxSim per query token (in [-1, 1] for normalized ColPali vectors), so the router's
+    thresholds see values comparable across query lengths.
+    Only chat is served locally; mind map, flash cards and quizzes still need the backend.
+    """
+
+    def __init__(self, index, query_encoder, chatbot: Chatbot = None, top_k: int = config.LOCAL_TOP_K,
+                 cache: QueryCache = None, excerpt_chars: int = 400):
+        self.index = index
+        self.query_encoder = query_encoder
+        self.chatbot = chatbot or Chatbot()
+        self.top_k = top_k
+        self.cache = cache
+        self.excerpt_chars = excerpt_chars
+        self.doc_version = f"local:{index.fingerprint}"
+
+    build_citation_html = ColPaliRAG.build_citation_html
+
+    @classmethod
+    def from_index(cls, path: str, query_encoder, **kwargs):
+        """Serve a memory-mapped, quantized index directory (see modules/multivector_index.py)."""
+        return cls(MultiVectorIndex.open(path), query_encoder, **kwargs)
+
+    def retrieve(self, query_text: str) -> list:
+        query_embeddings = self.query_encoder.encode(query_text)
+        retrieved = []
+        for citation, (page_idx, score) in enumerate(self.index.search(query_embeddings, self.top_k), start=1):
+            page = self.index.page(page_idx)
+            text = page.get("ocr_text", "")
+            retrieved.append({
+                "citation": citation,
+                "page_number": page.get("page_number"),
+                "score": score / max(len(query_embeddings), 1),
+                "excerpt": text[:self.excerpt_chars],
+                "content": text,
+                "thumbnail": page.get("thumbnail", ""),
+            })
+        return retrieved
+
+    def query(self, query_text: str, chat_history: list = None):
+        """Retrieve locally and answer with the Chatbot (served from the cache when possible)."""
+        if self.cache is not None:
+            cache_key = self.cache.make_key(query_text, chat_history, self.doc_version)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        retrieved = self.retrieve(query_text)
+        context = "\n\n".join(f"[{d['citation']}] (Page {d['page_number']})\n{d['content']}" for d in retrieved)
+        answer, _ = self.chatbot.answer_with_context(query_text, context)
+
+        result = {"answer": answer, "retrieved": retrieved}
+        if self.cache is not None:
+            self.cache.set(cache_key, result)
+        return result
+
+    def close(self):
+        pass
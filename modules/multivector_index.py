@@ -0,0 +1,232 @@
+# modules/multivector_index.py
+"""
+On-disk, memory-mapped index of per-page multi-vector (ColPali) embeddings.
+
+Layout of an index directory:
+    manifest.json      format version, dim, quantization, counts (written last: marks a complete index)
+    offsets.npy        int64 (pages + 1,) row boundaries of each page's vectors
+    vectors.npy        int8 (rows, dim) with scales.npy float32 (rows,)    -- quantization "int8"
+                       uint8 (rows, dim / 8) sign bits                      -- quantization "binary"
+    rerank.npy         float16 (rows, dim) half-precision vectors for reranking (optional)
+    pages.bin          UTF-8 JSON metadata of each page (page_number, thumbnail_ref, ...), concatenated,
+                       with pages_offsets.npy int64 (pages + 1,) byte boundaries
+    text.bin           UTF-8 OCR text of each page, concatenated, with text_offsets.npy byte boundaries
+    thumbnails/        base64 thumbnails referenced by thumbnail_ref
+
+Arrays and blobs are opened with mmap_mode="r" and decoded per page on demand, so opening
+takes milliseconds whatever the library size, and every worker process reading the same
+index shares its pages through the OS page cache. Search scores all pages on the quantized
+vectors, then reranks the best candidates with MaxSim on the float16 vectors.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import config
+
+FORMAT_VERSION = 2
+QUANTIZATIONS = ("int8", "binary")
+
+
+def _quantize_int8(vectors: np.ndarray):
+    """Symmetric per-vector int8: x ~= q * scale."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _write_blob(path: str, name: str, records: list):
+    """name.bin with the concatenated byte records and name_offsets.npy with their boundaries."""
+    with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+        for record in records:
+            f.write(record)
+    offsets = np.cumsum([0] + [len(r) for r in records]).astype(np.int64)
+    np.save(os.path.join(path, f"{name}_offsets.npy"), offsets)
+
+
+class _Blob:
+    """Memory-mapped view of a blob written by _write_blob; record i is decoded only when asked for."""
+
+    def __init__(self, path: str, name: str):
+        self.offsets = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode="r")
+        data_path = os.path.join(path, f"{name}.bin")
+        # np.memmap refuses empty files (e.g. an index without any OCR text)
+        self.data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) else b""
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.data[int(self.offsets[i]):int(self.offsets[i + 1])]).decode("utf-8")
+
+
+def build_index(path: str, page_embeddings: list, pages: list, quantization: str = config.INDEX_QUANTIZATION,
+                store_rerank_vectors: bool = True) -> str:
+    """
+    Write an index directory from per-page (tokens, dim) embeddings and page metadata dicts.
+    A page's "thumbnail" (base64) is moved to thumbnails/ and referenced by "thumbnail_ref";
+    its "ocr_text" goes to text.bin.
+    The index is built in a temp directory next to `path` and swapped into place, so readers never
+    see a half-written index. An existing `path` is only replaced if it is an index or empty.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization} (expected one of {QUANTIZATIONS})")
+    if len(page_embeddings) != len(pages):
+        raise ValueError("page_embeddings and pages must have the same length")
+    if any(len(e) == 0 for e in page_embeddings):
+        raise ValueError("Every page needs at least one vector")
+    if os.path.exists(path) and not (os.path.isdir(path) and (
+            not os.listdir(path) or os.path.exists(os.path.join(path, "manifest.json")))):
+        raise FileExistsError(f"{path} exists and is not an index directory; refusing to replace it")
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.build-", dir=parent)
+    try:
+        _write_index(build_dir, page_embeddings, pages, quantization, store_rerank_vectors)
+        if os.path.exists(path):
+            old_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.old-", dir=parent)
+            os.replace(path, old_dir)
+            os.replace(build_dir, path)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            os.replace(build_dir, path)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return path
+
+
+def _write_index(path: str, page_embeddings: list, pages: list, quantization: str, store_rerank_vectors: bool):
+    os.makedirs(os.path.join(path, "thumbnails"))
+    vectors = np.concatenate([np.asarray(e, dtype=np.float32) for e in page_embeddings])
+    offsets = np.cumsum([0] + [len(e) for e in page_embeddings]).astype(np.int64)
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+
+    if quantization == "int8":
+        quantized, scales = _quantize_int8(vectors)
+        np.save(os.path.join(path, "vectors.npy"), quantized)
+        np.save(os.path.join(path, "scales.npy"), scales)
+    else:
+        np.save(os.path.join(path, "vectors.npy"), np.packbits(vectors > 0, axis=1))
+    if store_rerank_vectors:
+        np.save(os.path.join(path, "rerank.npy"), vectors.astype(np.float16))
+
+    metadata, texts = [], []
+    for i, page in enumerate(pages):
+        page = dict(page)
+        thumbnail = page.pop("thumbnail", "")
+        texts.append(page.pop("ocr_text", "").encode("utf-8"))
+        if thumbnail:
+            page["thumbnail_ref"] = f"thumbnails/{i:06d}.b64"
+            with open(os.path.join(path, page["thumbnail_ref"]), "w", encoding="ascii") as t:
+                t.write(thumbnail)
+        metadata.append(json.dumps(page, ensure_ascii=False).encode("utf-8"))
+    _write_blob(path, "pages", metadata)
+    _write_blob(path, "text", texts)
+
+    digest = hashlib.sha256(offsets.tobytes())
+    digest.update(vectors[:: max(1, len(vectors) // 1024)].tobytes())  # a sample is enough to tell indexes apart
+    manifest = {
+        "version": FORMAT_VERSION,
+        "dim": int(vectors.shape[1]),
+        "quantization": quantization,
+        "pages": len(pages),
+        "vectors": int(len(vectors)),
+        "rerank_vectors": store_rerank_vectors,
+        "fingerprint": digest.hexdigest()[:16],
+    }
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+class MultiVectorIndex:
+    """
+    Read-only view of an index directory; a drop-in for InMemoryPageIndex in LocalColPaliRAG.
+    search() scores every page on the quantized vectors (MaxSim via np.maximum.reduceat over
+    page offsets, in row blocks) and reranks the top k * rerank_factor on the float16 vectors.
+    """
+
+    def __init__(self, path: str, rerank_factor: int = None,
+                 block_rows: int = config.INDEX_SCORE_BLOCK_ROWS):
+        self.path = path
+        self.block_rows = block_rows
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No complete index at {path} (manifest.json missing)")
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {self.manifest['version']}")
+        self.quantization = self.manifest["quantization"]
+        self.rerank_factor = rerank_factor or config.INDEX_RERANK_FACTOR[self.quantization]
+        self.fingerprint = self.manifest["fingerprint"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if self.quantization == "int8" else None
+        rerank_path = os.path.join(path, "rerank.npy")
+        self.rerank = np.load(rerank_path, mmap_mode="r") if self.manifest["rerank_vectors"] else None
+        self._metadata = _Blob(path, "pages")
+        self._texts = _Blob(path, "text")
+
+    @classmethod
+    def open(cls, path: str, **kwargs):
+        return cls(path, **kwargs)
+
+    def __len__(self):
+        return self.manifest["pages"]
+
+    def page(self, page_idx: int) -> dict:
+        """Page metadata with its OCR text and thumbnail (base64), read from the mapped files on demand."""
+        page = json.loads(self._metadata[page_idx])
+        page["ocr_text"] = self._texts[page_idx]
+        ref = page.pop("thumbnail_ref", None)
+        if ref:
+            with open(os.path.join(self.path, ref), "r", encoding="ascii") as f:
+                page["thumbnail"] = f.read()
+        return page
+
+    def _approximate_similarity(self, rows: slice, query: np.ndarray) -> np.ndarray:
+        """(rows, query tokens) similarity from the quantized vectors."""
+        if self.quantization == "int8":
+            return (self.vectors[rows].astype(np.float32) @ query.T) * self.scales[rows][:, None]
+        # Binary: asymmetric distance, the full-precision query against the +-1 sign vectors
+        signs = np.unpackbits(self.vectors[rows], axis=1, count=self.manifest["dim"]).astype(np.float32) * 2.0 - 1.0
+        return (signs @ query.T) / np.sqrt(self.manifest["dim"])
+
+    def approximate_scores(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Approximate MaxSim score of every page, shape (pages,)."""
+        query = np.asarray(query_embeddings, dtype=np.float32)
+        n_pages = len(self)
+        scores = np.empty(n_pages, dtype=np.float32)
+        page = 0
+        while page < n_pages:
+            # Whole pages per block, about block_rows rows (at least one page)
+            start_row = self.offsets[page]
+            end_page = max(page + 1, int(np.searchsorted(self.offsets, start_row + self.block_rows, side="right")) - 1)
+            end_page = min(end_page, n_pages)
+            rows = slice(int(start_row), int(self.offsets[end_page]))
+            similarity = self._approximate_similarity(rows, query)
+            page_max = np.maximum.reduceat(similarity, self.offsets[page:end_page] - start_row, axis=0)
+            scores[page:end_page] = page_max.sum(axis=1)
+            page = end_page
+        return scores
+
+    def rerank_score(self, page_idx: int, query: np.ndarray) -> float:
+        """MaxSim of one page on its float16 rerank vectors."""
+        page_vectors = np.asarray(self.rerank[self.offsets[page_idx]:self.offsets[page_idx + 1]], dtype=np.float32)
+        return float((page_vectors @ query.T).max(axis=0).sum())
+
+    def search(self, query_embeddings: np.ndarray, k: int) -> list:
+        """Top-k (page index, score) pairs, best first; scores come from rerank.npy when the index has it."""
+        query = np.asarray(query_embeddings, dtype=np.float32)
+        scores = self.approximate_scores(query)
+        n_candidates = min(len(scores), k * self.rerank_factor if self.rerank is not None else k)
+        if n_candidates == 0:
+            return []
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        if self.rerank is not None:
+            ranked = [(int(i), self.rerank_score(int(i), query)) for i in candidates]
+        else:
+            ranked = [(int(i), float(scores[i])) for i in candidates]
+        ranked.sort(key=lambda item: -item[1])
+        return ranked[:k]
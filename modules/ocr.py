@@ -0,0 +1,114 @@
+# modules/ocr.py
+"""
+Page-text extraction with Tesseract.
+Pages are OCR'd in a process pool sized to the core count, results are cached on disk
+by (page pixels, language, Tesseract config), and a whole-PDF entry keyed by the file
+hash lets re-indexing a known PDF skip rasterization and OCR entirely.
+"""
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+import pytesseract
+from PIL import Image
+import config
+from modules.utils import DiskCache, file_sha256, iter_pdf_images
+
+
+def _ocr_page(mode: str, size: tuple, pixels: bytes, lang: str, tesseract_config: str) -> str:
+    """Worker-process entry point: raw pixels in, text out (images are not picklable cheaply)."""
+    image = Image.frombytes(mode, size, pixels)
+    return pytesseract.image_to_string(image, lang=lang, config=tesseract_config)
+
+
+class OCRPipeline:
+    """
+    Usage:
+        ocr = OCRPipeline()
+        texts = ocr.ocr_pdf("book.pdf")              # page-ordered list of strings
+        texts = ocr.ocr_pages(iter_pdf_images(path))  # or any iterable of PIL images
+    """
+
+    def __init__(self, lang: str = config.OCR_LANG, tesseract_config: str = config.OCR_TESSERACT_CONFIG,
+                 workers: int = config.OCR_WORKERS, cache_dir: str = config.OCR_CACHE_DIR,
+                 cache_max_bytes: int = config.OCR_CACHE_MAX_BYTES):
+        self.lang = lang
+        self.tesseract_config = tesseract_config
+        self.workers = max(1, workers)
+        self.cache = DiskCache(cache_dir, max_bytes=cache_max_bytes, suffix=".json") if cache_dir else None
+        self._executor = None
+        self._settings_key = None
+        self.stats = {"pages": 0, "cache_hits": 0, "pdf_cache_hits": 0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _settings(self) -> str:
+        """Cache-key part for everything that changes the output: language, config and engine version."""
+        if self._settings_key is None:
+            self._settings_key = f"{self.lang}\x00{self.tesseract_config}\x00{pytesseract.get_tesseract_version()}"
+        return self._settings_key
+
+    def _cache_get(self, key: str):
+        data = self.cache.get(key) if self.cache is not None else None
+        return json.loads(data) if data is not None else None
+
+    def _cache_set(self, key: str, value):
+        if self.cache is not None:
+            self.cache.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def iter_texts(self, images):
+        """
+        OCR a stream of PIL images and yield their texts in page order.
+        At most 2 x workers pages are held in flight, so a streamed PDF stays bounded in memory.
+        """
+        settings = self._settings()
+        pending = []  # (cache key, future or cached text)
+
+        def finish(entry):
+            key, result = entry
+            if isinstance(result, str):
+                return result
+            text = result.result()
+            self._cache_set(key, text)
+            return text
+
+        for image in images:
+            self.stats["pages"] += 1
+            gray = image.convert("L")  # Tesseract binarizes anyway; a third of the bytes to hash and ship
+            pixels = gray.tobytes()
+            digest = hashlib.sha256(f"{gray.size}".encode("utf-8"))
+            digest.update(pixels)
+            key = f"page\x00{digest.hexdigest()}\x00{settings}"
+            cached = self._cache_get(key)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                pending.append((key, cached))
+            else:
+                pending.append((key, self._pool().submit(
+                    _ocr_page, gray.mode, gray.size, pixels, self.lang, self.tesseract_config)))
+            while len(pending) > 2 * self.workers:
+                yield finish(pending.pop(0))
+        for entry in pending:
+            yield finish(entry)
+
+    def ocr_pages(self, images) -> list:
+        """Page-ordered texts for an iterable of PIL images."""
+        return list(self.iter_texts(images))
+
+    def ocr_pdf(self, pdf_path: str, dpi: int = 200) -> list:
+        """Page-ordered texts of a PDF; a PDF seen before (same bytes and settings) is not even rasterized."""
+        key = f"pdf\x00{file_sha256(pdf_path)}\x00{dpi}\x00{self._settings()}"
+        texts = self._cache_get(key)
+        if texts is not None:
+            self.stats["pdf_cache_hits"] += 1
+            return texts
+        texts = self.ocr_pages(iter_pdf_images(pdf_path, dpi=dpi))
+        self._cache_set(key, texts)
+        return texts
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,25 +1,254 @@
+import asyncio
 import requests
+import httpx
 import html
 import re
 import textwrap
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import config
+from modules.utils import DiskCache, base64_data_uri
+
+
+def _build_session(pool_size: int, max_retries: int, backoff: float) -> requests.Session:
+    """
+    Create a keep-alive session with a bounded pool. Only failed connects and 502/503/504 on
+    idempotent methods are retried: a read timeout means the backend is still working (e.g. a
+    slow /mindmap generation), and re-sending the request would only start the work over.
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class QueryCache:
+    """
+    Content-addressed cache for ColPaliRAG.query responses.
+    Keys combine the normalized query, a hash of the recent chat-history slice and the
+    document/index version. A size-bounded in-memory LRU sits in front of an optional
+    on-disk tier (TTL + size eviction); hit/miss counters are exposed through stats().
+    """
+
+    def __init__(self, max_entries: int = config.QUERY_CACHE_MAX_ENTRIES, ttl: float = config.QUERY_CACHE_TTL,
+                 disk_dir: str = config.QUERY_CACHE_DIR, disk_max_bytes: int = config.QUERY_CACHE_DISK_MAX_BYTES,
+                 history_turns: int = 4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self._memory = OrderedDict()  # key -> (stored_at, response)
+        self._lock = threading.Lock()
+        self.disk = DiskCache(disk_dir, max_bytes=disk_max_bytes, ttl=ttl, suffix=".json") if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(query_text: str) -> str:
+        """Case/width/whitespace-insensitive form of a question (works for Arabic and English)."""
+        text = unicodedata.normalize("NFKC", query_text).casefold()
+        text = re.sub(r"[\u064B-\u0652\u0640]", "", text)  # Arabic diacritics and tatweel
+        text = " ".join(text.split())
+        return text.rstrip("?!.؟ ")
+
+    def make_key(self, query_text: str, chat_history: list = None, doc_version: str = "") -> str:
+        history = (chat_history or [])[-self.history_turns:] if self.history_turns else []
+        history_slice = [(m.get("role"), m.get("content")) for m in history if isinstance(m, dict)]
+        history_hash = hashlib.sha256(
+            json.dumps(history_slice, ensure_ascii=False, default=str).encode("utf-8")
+        ).hexdigest()
+        raw = f"{doc_version}\x00{history_hash}\x00{self.normalize_query(query_text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and (self.ttl is None or now - entry[0] <= self.ttl):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._memory[key]
+        if self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None:
+                response = json.loads(data)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._remember(key, response, now)
+                return response
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, response: dict):
+        self._remember(key, response, time.time())
+        if self.disk is not None:
+            self.disk.set(key, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+    def _remember(self, key: str, response: dict, stored_at: float):
+        with self._lock:
+            self._memory[key] = (stored_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self.disk) if self.disk is not None else 0,
+            }
+
+
+def _index_version(response) -> str:
+    """
+    Version of the backend's current index from a response: the X-Index-Version header, or an
+    index_version / index_id / doc_hash field in a JSON body. None if the backend does not report one.
+    """
+    version = response.headers.get(config.BACKEND_INDEX_VERSION_HEADER)
+    if not version:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            version = next((str(body[f]) for f in ("index_version", "index_id", "doc_hash") if body.get(f)), None)
+    return version or None
+
 
 class ColPaliRAG:
-    def __init__(self, api_url: str):
+    def __init__(
+        self, api_url: str,
+        connect_timeout: float = config.BACKEND_CONNECT_TIMEOUT,
+        read_timeout: float = config.BACKEND_READ_TIMEOUT,
+        pool_size: int = config.BACKEND_POOL_SIZE,
+        max_retries: int = config.BACKEND_MAX_RETRIES,
+        retry_backoff: float = config.BACKEND_RETRY_BACKOFF,
+        cache: QueryCache = None,
+        doc_version: str = None,
+    ):
         if not api_url.startswith("https://"):
             raise ValueError("Invalid ngrok URL. It must start with 'https://'")
         self.api_url = api_url.rstrip('/')
+        self.cache = cache
+        # Identifies the indexed document for cache keys. Taken from the backend unless pinned by the caller;
+        # a backend that reports no version gets no response cache, since an upload can replace the index
+        self._pinned_version = doc_version
+        self.doc_version = doc_version
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # One pooled keep-alive session for every backend call (avoids a TCP+TLS handshake per request)
+        self.session = _build_session(pool_size, max_retries, retry_backoff)
         # Test the connection to the API server
-        response = requests.get(self.api_url)
+        response = self._request("GET", "", read_timeout=connect_timeout)
         response.raise_for_status() # This will raise an error if the connection fails
+        self.doc_version = doc_version or _index_version(response)
+        if self.cache is not None and self.doc_version is None:
+            print("⚠️ Backend reports no index version; query responses will not be cached")
+            self.cache = None
+
+    def _request(self, method: str, path: str, read_timeout: float = None, **kwargs):
+        """Send a request to the backend through the shared session with (connect, read) timeouts."""
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        return self.session.request(method, f"{self.api_url}{path}", timeout=timeout, **kwargs)
+
+    def close(self):
+        """Release the pooled connections."""
+        self.session.close()
+
+    def refresh_index_version(self):
+        """
+        Re-read the backend's index version (GET /). Call it on an explicit event such as an upload
+        or a refresh, so a new PDF is never answered from the previous document's cache entries;
+        queries themselves only pick up a version that the /query response reports.
+        """
+        if self._pinned_version is not None or self.cache is None:
+            return self.doc_version
+        try:
+            response = self._request("GET", "", read_timeout=self.connect_timeout)
+            response.raise_for_status()
+            self.doc_version = _index_version(response)
+        except requests.RequestException:
+            self.doc_version = None
+        if self.doc_version is None:
+            # The document can no longer be identified: stop caching rather than risk stale answers
+            self.cache = None
+        return self.doc_version
 
     def query(self, query_text: str,chat_history: list = None):
-        """Sends the query and chat history to the Colab API."""
-        endpoint = f"{self.api_url}/query"
+        """Sends the query and chat history to the Colab API (served from the cache when possible)."""
+        if self.cache is not None:
+            cached = self.cache.get(self.cache.make_key(query_text, chat_history, self.doc_version))
+            if cached is not None:
+                return cached
+
         payload = {"query_text": query_text, "chat_history": chat_history or []}
         
-        response = requests.post(endpoint, json=payload, timeout=120) # 2-minute timeout
+        response = self._request("POST", "/query", json=payload)
         response.raise_for_status() # Raise an error for bad responses
         
+        result = response.json()
+        if self.cache is not None:
+            reported = _index_version(response)
+            if reported and self._pinned_version is None:
+                # The backend re-indexed since we last looked: entries of the old version become unreachable
+                self.doc_version = reported
+            self.cache.set(self.cache.make_key(query_text, chat_history, self.doc_version), result)
+        return result
+
+    def mindmap(self) -> str:
+        """Fetch the rendered mind-map HTML for the indexed document."""
+        response = self._request("GET", "/mindmap")
+        response.raise_for_status()
+        return response.text
+
+    def generate_flash_cards(self, num_cards: int = 5) -> dict:
+        """Generate flash cards; returns the backend JSON (with an "html" key)."""
+        response = self._request("POST", "/generate_flash_cards", data={"num_cards": str(num_cards)})
+        response.raise_for_status()
+        return response.json()
+
+    def generate_quiz(self, num_mcq: int = 5, num_tf: int = 2, lang: str = "en") -> dict:
+        """Generate a quiz; returns the backend JSON (with a "quiz" key)."""
+        data = {"num_mcq": str(num_mcq), "num_tf": str(num_tf), "lang": lang}
+        response = self._request("POST", "/generate_quiz", data=data)
+        response.raise_for_status()
+        return response.json()
+
+    def grade_quiz(self, incorrect_answers: list) -> dict:
+        """Get feedback for incorrect quiz answers; returns the backend JSON (with a "feedback" key)."""
+        response = self._request("POST", "/grade_quiz", json={"incorrect_answers": incorrect_answers})
+        response.raise_for_status()
         return response.json()
 
     def build_citation_html(self, answer: str, retrieved_docs: list) -> str:
@@ -103,7 +332,7 @@ class ColPaliRAG:
             tooltip_text = html.escape(doc.get('excerpt', '')[:400])
             thumbnail_b64 = doc.get('thumbnail', '')
             
-            img_html = f'<img src="data:image/png;base64,{thumbnail_b64}" style="margin-top:12px;width:100%;max-width:300px;height:auto;border:1px solid #4a5568;border-radius:4px;display:block;" />' if thumbnail_b64 else ''
+            img_html = f'<img src="{base64_data_uri(thumbnail_b64)}" style="margin-top:12px;width:100%;max-width:300px;height:auto;border:1px solid #4a5568;border-radius:4px;display:block;" />' if thumbnail_b64 else ''
             
             return f"""<span class="{hover_class}">[{citation_num}]<span class="{tooltip_class}"><div style="font-weight:bold;margin-bottom:10px;font-size:14px;color:#60a5fa;">{tooltip_header}</div><div style="margin-top:8px;line-height:1.5;color:#cbd5e0;">{tooltip_text}</div>{img_html}</span></span>"""
         
@@ -174,3 +403,106 @@ class ColPaliRAG:
         """
         
         return final_html
+
+
+class AsyncColPaliRAG:
+    """
+    asyncio counterpart of ColPaliRAG built on httpx.AsyncClient.
+    Every endpoint is a coroutine, so independent calls can run concurrently:
+
+        async with AsyncColPaliRAG(url) as client:
+            mindmap_html, cards = await asyncio.gather(client.mindmap(), client.generate_flash_cards(5))
+
+    The client is bound to the event loop it was opened on; open it inside the coroutine that uses it.
+    """
+
+    def __init__(
+        self, api_url: str,
+        connect_timeout: float = config.BACKEND_CONNECT_TIMEOUT,
+        read_timeout: float = config.BACKEND_READ_TIMEOUT,
+        pool_size: int = config.BACKEND_POOL_SIZE,
+        max_retries: int = config.BACKEND_MAX_RETRIES,
+        retry_backoff: float = config.BACKEND_RETRY_BACKOFF,
+    ):
+        if not api_url.startswith("https://"):
+            raise ValueError("Invalid ngrok URL. It must start with 'https://'")
+        self.api_url = api_url.rstrip('/')
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.client = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            # With an explicit transport httpx ignores the client's limits=, so the pool is configured here
+            transport=httpx.AsyncHTTPTransport(
+                retries=max_retries,  # retries failed connects only
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        """Release the pooled connections."""
+        await self.client.aclose()
+
+    async def _get(self, path: str) -> httpx.Response:
+        """GET with exponential backoff on 502/503/504 (GET is idempotent, so it is safe to retry)."""
+        for attempt in range(self.max_retries + 1):
+            response = await self.client.get(path)
+            if response.status_code not in (502, 503, 504) or attempt == self.max_retries:
+                break
+            await asyncio.sleep(self.retry_backoff * (2 ** attempt))
+        response.raise_for_status()
+        return response
+
+    async def _post(self, path: str, **kwargs) -> httpx.Response:
+        response = await self.client.post(path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def query(self, query_text: str, chat_history: list = None) -> dict:
+        """Sends the query and chat history to the Colab API."""
+        payload = {"query_text": query_text, "chat_history": chat_history or []}
+        response = await self._post("/query", json=payload)
+        return response.json()
+
+    async def mindmap(self) -> str:
+        """Fetch the rendered mind-map HTML for the indexed document."""
+        response = await self._get("/mindmap")
+        return response.text
+
+    async def generate_flash_cards(self, num_cards: int = 5) -> dict:
+        """Generate flash cards; returns the backend JSON (with an "html" key)."""
+        response = await self._post("/generate_flash_cards", data={"num_cards": str(num_cards)})
+        return response.json()
+
+    async def generate_quiz(self, num_mcq: int = 5, num_tf: int = 2, lang: str = "en") -> dict:
+        """Generate a quiz; returns the backend JSON (with a "quiz" key)."""
+        data = {"num_mcq": str(num_mcq), "num_tf": str(num_tf), "lang": lang}
+        response = await self._post("/generate_quiz", data=data)
+        return response.json()
+
+    async def grade_quiz(self, incorrect_answers: list) -> dict:
+        """Get feedback for incorrect quiz answers; returns the backend JSON (with a "feedback" key)."""
+        response = await self._post("/grade_quiz", json={"incorrect_answers": incorrect_answers})
+        return response.json()
+
+    async def preload(self, num_cards: int = 5) -> dict:
+        """
+        Fetch the mind map and flash cards concurrently.
+        Returns {"mindmap_html": str | None, "flash_cards_html": str | None, "errors": {name: Exception}}.
+        """
+        mindmap_html, cards = await asyncio.gather(
+            self.mindmap(), self.generate_flash_cards(num_cards), return_exceptions=True
+        )
+        errors = {name: result for name, result in (("mindmap", mindmap_html), ("flash_cards", cards))
+                  if isinstance(result, Exception)}
+        return {
+            "mindmap_html": None if "mindmap" in errors else mindmap_html,
+            "flash_cards_html": None if "flash_cards" in errors else cards.get("html"),
+            "errors": errors,
+        }
@@ -1,40 +1,25 @@
 from modules.chatbot import Chatbot
-from io import BytesIO
-from pydub import AudioSegment
-def route_response(mode: str, base_answer: str, chat: Chatbot):
+from modules.audio import pcm_to_wav
+def route_response(mode: str, base_answer: str, chat: Chatbot, on_audio_chunk=None):
     """
     Only routes/rendering — no extra prompting.
+    on_audio_chunk(index, pcm) receives each synthesized chunk as soon as it is ready (audio/video modes).
+    Audio/video results carry "content" (WAV bytes for st.audio) and "pcm" (raw 24 kHz 16-bit mono).
     """
     mode = (mode or "text").lower()
 
     if mode == "audio":
-        audio_bytes = chat.text_to_speech_Audio(base_answer)
-            # Convert to WAV (requires ffmpeg)
-        audio_seg = AudioSegment(
-                data=audio_bytes,
-                sample_width=2,  # 16-bit PCM
-                frame_rate=24000,
-                channels=1
-            )  # or actual format
-        buf = BytesIO()
-        audio_seg.export(buf, format="wav")
-    
-        return {"type": "audio", "content": buf.getvalue(), "subtype": "speech"}
+        audio_bytes = chat.text_to_speech_Audio(base_answer, on_chunk=on_audio_chunk)
+        if audio_bytes is None:
+            return {"type": "text", "content": base_answer}
+        return {"type": "audio", "content": pcm_to_wav(audio_bytes), "pcm": audio_bytes, "subtype": "speech"}
      
     
     if mode == "video":
-        audio_bytes = chat.text_to_speech(base_answer)
-            # Convert to WAV (requires ffmpeg)
-        audio_seg = AudioSegment(
-                data=audio_bytes,
-                sample_width=2,  # 16-bit PCM
-                frame_rate=24000,
-                channels=1
-            )  # or actual format
-        buf = BytesIO()
-        audio_seg.export(buf, format="wav")
-    
-        return {"type": "video", "content": buf.getvalue(), "subtype": "speech"}
+        audio_bytes = chat.text_to_speech(base_answer, on_chunk=on_audio_chunk)
+        if audio_bytes is None:
+            return {"type": "text", "content": base_answer}
+        return {"type": "video", "content": pcm_to_wav(audio_bytes), "pcm": audio_bytes, "subtype": "speech"}
        
 
     if mode == "visual":
@@ -1,5 +1,12 @@
 import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
+import config
 
 # Optional: if you’re using Tavily or Bing API
 from langchain_community.tools.tavily_search.tool import TavilySearchResults
@@ -57,6 +64,168 @@ def judge_answer_relevance(llm, query: str, answer: str) -> bool:
     # decision = response.strip().upper()
     return response.text.strip().lower().startswith("y") # YES → relevant
 
+# ==============================
+# ⚡ Local Relevance Gate
+# ==============================
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_CITATION_RE = re.compile(r"\[(\d+)\]")
+_STOPWORDS = frozenset("""
+a an the and or but if then of to in on at by for with from as is are was were be been being do does did
+what which who whom whose when where why how this that these those it its i you he she we they me my your
+can could should would will shall may might must not no yes about into over than so such there here
+في من على إلى عن ما ماذا هل هو هي هذا هذه ذلك التي الذي كيف لماذا متى أين مع أو و ثم
+""".split())
+_REFUSAL_RE = re.compile(
+    r"cannot find|can't find|could not find|couldn't find|not present in|not (?:mentioned|provided|found|available) in"
+    r"|no information|does not contain|doesn't contain|لم أجد|لا يوجد|غير موجود|لا تحتوي",
+    re.IGNORECASE,
+)
+_FIRST_SENTENCE_RE = re.compile(r"[^.!?؟\n]*")
+
+
+def _stem(token: str) -> str:
+    """Very light suffix/prefix stripping so 'converts'/'converted' and 'الخلية'/'خلية' match."""
+    if token.startswith("ال") and len(token) > 4:
+        return token[2:]
+    for suffix in ("ing", "ed", "es", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3 and not token.endswith("ss"):
+            return token[:-len(suffix)]
+    return token
+
+
+def _terms(text: str) -> list:
+    return [_stem(t) for t in _TOKEN_RE.findall((text or "").casefold()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def _is_arabic(text: str) -> bool:
+    letters = [c for c in text or "" if c.isalpha()]
+    return bool(letters) and sum(1 for c in letters if '\u0600' <= c <= '\u06FF') / len(letters) > 0.3
+
+
+def _bm25_match(query_terms: list, docs: list, corpus: list, k1: float = 1.5, b: float = 0.75) -> float:
+    """
+    Best BM25 score of the query over `docs` (IDF/length statistics from `corpus`),
+    scaled so that one occurrence of every query term in an average-length doc scores 1.0.
+    """
+    unique_terms = set(query_terms)
+    if not unique_terms or not docs or not corpus:
+        return 0.0
+    n_docs = len(corpus)
+    avg_len = sum(len(d) for d in corpus) / n_docs or 1.0
+    df = Counter(t for d in corpus for t in set(d))
+    idf = {t: math.log(1 + (n_docs - df[t] + 0.5) / (df[t] + 0.5)) for t in unique_terms}
+    upper = sum(idf.values())
+    if upper == 0:
+        return 0.0
+    best = 0.0
+    for doc in docs:
+        tf = Counter(doc)
+        norm = k1 * (1 - b + b * len(doc) / avg_len)
+        score = sum(idf[t] * tf[t] * (k1 + 1) / (tf[t] + norm) for t in unique_terms if tf[t])
+        best = max(best, score)
+    return min(1.0, best / upper)
+
+
+def local_relevance_score(query: str, answer: str, retrieved: list) -> dict:
+    """
+    CPU-only relevance signals for an internal RAG answer:
+    BM25 match of the query against the answer and the retrieved excerpts, how much of the
+    answer's vocabulary is grounded in the excerpts, and whether its [n] citations point at
+    retrieved sources. Returns the individual signals plus a combined "score" in [0, 1].
+    """
+    query_terms = _terms(query)
+    answer_terms = _terms(answer)
+    excerpts = [_terms(d.get("excerpt") or d.get("content") or "") for d in retrieved or []]
+    corpus = excerpts + [answer_terms]
+
+    answer_match = _bm25_match(query_terms, [answer_terms], corpus)
+    excerpt_match = _bm25_match(query_terms, excerpts, corpus)
+    excerpt_vocab = set().union(*excerpts) if excerpts else set()
+    answer_vocab = set(answer_terms)
+    grounding = len(answer_vocab & excerpt_vocab) / len(answer_vocab) if answer_vocab else 0.0
+
+    cited = {int(n) for n in _CITATION_RE.findall(answer or "")}
+    known = {d.get("citation") for d in retrieved or []}
+    citation_coverage = len(cited & known) / len(cited) if cited else 0.0
+
+    # Only an answer that opens with a refusal and cites nothing is one; the same phrase
+    # inside a cited answer ("... no information on dosage, but [2] ...") is merely a hint
+    refusal_hint = bool(_REFUSAL_RE.search(answer or ""))
+    leading = _FIRST_SENTENCE_RE.match((answer or "").strip()).group(0)
+    refusal = refusal_hint and not cited and bool(_REFUSAL_RE.search(leading))
+    # Lexical signals say nothing when the question and the document are in different languages
+    excerpt_text = " ".join(d.get("excerpt") or d.get("content") or "" for d in retrieved or [])
+    cross_lingual = bool(excerpt_text.strip()) and _is_arabic(query) != _is_arabic(excerpt_text)
+    score = 0.0 if refusal else (
+        0.4 * answer_match + 0.2 * excerpt_match + 0.2 * grounding + 0.2 * citation_coverage
+    )
+    return {
+        "score": score,
+        "answer_match": answer_match,
+        "excerpt_match": excerpt_match,
+        "grounding": grounding,
+        "citation_coverage": citation_coverage,
+        "refusal": refusal,
+        "refusal_hint": refusal_hint,
+        "cross_lingual": cross_lingual,
+    }
+
+
+class RelevanceGate:
+    """
+    Decides clear accept / clear reject cases locally; only the ambiguous band
+    between the two thresholds is left for the LLM judge. Keeps decision counters.
+    """
+
+    def __init__(self, accept_threshold: float = config.RELEVANCE_ACCEPT_THRESHOLD,
+                 reject_threshold: float = config.RELEVANCE_REJECT_THRESHOLD):
+        if reject_threshold > accept_threshold:
+            raise ValueError("reject_threshold must not exceed accept_threshold")
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def decide(self, query: str, answer: str, retrieved: list):
+        """
+        Returns ("accept" | "reject" | "ambiguous", signals dict).
+        No query-term overlap with the answer or the excerpts is left to the LLM judge rather than
+        decided either way: follow-ups ("Why?", "Tell me more about that") share no terms with
+        anything, and grounding and citations alone do not show that the answer addresses the query.
+        """
+        signals = local_relevance_score(query, answer, retrieved)
+        no_query_overlap = signals["answer_match"] == 0 and signals["excerpt_match"] == 0
+        if signals["refusal"]:
+            decision = "reject"
+        elif signals["cross_lingual"] or no_query_overlap or signals["refusal_hint"]:
+            decision = "ambiguous"
+        elif signals["score"] <= self.reject_threshold:
+            decision = "reject"
+        elif signals["score"] >= self.accept_threshold:
+            decision = "accept"
+        else:
+            decision = "ambiguous"
+        with self._lock:
+            self.counts[decision] += 1
+        logger.info(f"Local relevance gate: {decision} (score={signals['score']:.2f})")
+        return decision, signals
+
+    def stats(self) -> dict:
+        """Decision counts and the share of turns decided without the LLM judge."""
+        with self._lock:
+            total = sum(self.counts.values())
+            rates = {k: (self.counts[k] / total if total else 0.0) for k in ("accept", "reject", "ambiguous")}
+            return {
+                "total": total,
+                "counts": dict(self.counts),
+                "rates": rates,
+                "local_decision_rate": 1.0 - rates["ambiguous"] if total else 0.0,
+            }
+
+
+relevance_gate = RelevanceGate()
+
+
 def judge_relevance(llm, query: str, context: str) -> bool:
     """
     Ask LLM whether the retrieved context is relevant to the query.
@@ -86,31 +255,166 @@ def judge_relevance(llm, query: str, context: str) -> bool:
 # config.py
 TAVILY_API_KEY = ""
 
-def web_search_agent(query: str) -> str:
+class SearchBackend:
     """
-    Retrieve relevant information from the web using Tavily or any search API.
-    Returns aggregated search results as text context.
+    Interface for web search providers used by web_search_agent.
+    search() returns the aggregated result text and raises on failure.
     """
-    try:
-        search = TavilySearchResults(tavily_api_key=TAVILY_API_KEY,max_results=3)
-        results = search.run(query)
+
+    def search(self, query: str) -> str:
+        raise NotImplementedError
+
+
+class TavilySearchBackend(SearchBackend):
+    """Tavily search; the LangChain tool is built once and reused for every query."""
+
+    def __init__(self, api_key: str = TAVILY_API_KEY, max_results: int = 3):
+        self.tool = TavilySearchResults(tavily_api_key=api_key, max_results=max_results)
+
+    def search(self, query: str) -> str:
+        results = self.tool.run(query)
         if isinstance(results, list):
             # Tavily returns list of dicts
-            context = "\n\n".join([r.get("content", "") for r in results])
-        else:
-            context = str(results)
-        return context
+            return "\n\n".join([r.get("content", "") for r in results])
+        return str(results)
+
+
+class StaticSearchBackend(SearchBackend):
+    """Local stub backend: canned results keyed by query, with a call counter (tests / offline runs)."""
+
+    def __init__(self, results: Optional[dict] = None, default: str = ""):
+        self.results = results or {}
+        self.default = default
+        self.calls = 0
+
+    def search(self, query: str) -> str:
+        self.calls += 1
+        result = self.results.get(query, self.default)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class SearchCache:
+    """
+    TTL + size-bounded cache of web search results keyed by normalized query text.
+    Failures are cached for a shorter negative TTL, and concurrent lookups of the
+    same query share a single outbound search (request coalescing).
+    """
+
+    def __init__(self, ttl: float = config.WEB_SEARCH_CACHE_TTL,
+                 negative_ttl: float = config.WEB_SEARCH_NEGATIVE_TTL,
+                 max_entries: int = config.WEB_SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, context or None for a cached failure)
+        self._inflight = {}  # key -> Future shared by coalesced callers
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.casefold().split()).strip("?!.؟ ")
+
+    def get_or_search(self, query: str, backend: SearchBackend) -> str:
+        """Cached result for the query, or run (or join an in-flight) search. Returns "" on failure."""
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.counts["negative_hits" if entry[1] is None else "hits"] += 1
+                return entry[1] or ""
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.counts["misses"] += 1
+            else:
+                self.counts["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            context = backend.search(query)
+        except Exception as e:
+            logger.error(f"Web search failed: {e}")
+            context = None
+        with self._lock:
+            ttl = self.ttl if context is not None else self.negative_ttl
+            self._entries[key] = (time.monotonic() + ttl, context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            del self._inflight[key]
+        future.set_result(context or "")
+        return context or ""
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "entries": len(self._entries)}
+
+
+search_cache = SearchCache()
+_default_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend() -> SearchBackend:
+    """Process-wide Tavily backend, created on first use."""
+    global _default_backend
+    with _backend_lock:
+        if _default_backend is None:
+            _default_backend = TavilySearchBackend()
+        return _default_backend
+
+
+def web_search_agent(query: str, backend: Optional[SearchBackend] = None,
+                     cache: Optional[SearchCache] = None) -> str:
+    """
+    Retrieve relevant information from the web using Tavily or any search API.
+    Returns aggregated search results as text context ("" if the search failed).
+    """
+    try:
+        backend = backend or get_search_backend()
     except Exception as e:
         logger.error(f"Web search failed: {e}")
         return ""
+    return (cache or search_cache).get_or_search(query, backend)
 
 
 # ==============================
 # 🚦 Router
 # ==============================
-def router(llm, retrieved ,internal_answer, query: str, min_score_threshold: float = 0.4) -> dict:
+# Runs speculative web searches alongside the LLM relevance judge
+_search_executor = ThreadPoolExecutor(
+    max_workers=config.SPECULATIVE_SEARCH_WORKERS, thread_name_prefix="speculative-search"
+)
+speculation_stats = Counter()
+
+
+def routing_stats(gate: Optional[RelevanceGate] = None) -> dict:
+    """Relevance-gate hit rates, web search cache counters and speculative-search outcomes."""
+    return {
+        "relevance_gate": (gate or relevance_gate).stats(),
+        "search_cache": search_cache.stats(),
+        "speculative_search": dict(speculation_stats),
+    }
+
+
+def router(llm, retrieved ,internal_answer, query: str, min_score_threshold: float = 0.4,
+           gate: Optional[RelevanceGate] = None,
+           speculative_band: Optional[tuple] = config.SPECULATIVE_SEARCH_BAND) -> dict:
     """
     Decides whether to use internal RAG or web search.
+    When the LLM judge is needed and the top score falls in `speculative_band` (low, high),
+    the web search starts concurrently with the judge and is discarded if the judge says yes.
     Returns dict with:
     {
         "mode": "internal" | "web",
@@ -147,12 +451,36 @@ def router(llm, retrieved ,internal_answer, query: str, min_score_threshold: flo
     # 4️⃣ Generate internal answer using your Colab RAG model
     route["answer"] = internal_answer
 
-    # 5️⃣ Use LLM to judge whether the answer actually addresses the query
-    is_relevant = judge_answer_relevance(llm, query, internal_answer)
-    print(f"LLM judge relevance: {is_relevant}")
+    # 5️⃣ Decide clear cases locally; only the ambiguous band goes to the LLM judge
+    gate = gate or relevance_gate
+    decision, _ = gate.decide(query, internal_answer, retrieved)
+    speculative_search = None
+    if decision == "ambiguous":
+        if speculative_band and speculative_band[0] <= top_score < speculative_band[1]:
+            speculative_search = _search_executor.submit(web_search_agent, query)
+        try:
+            is_relevant = judge_answer_relevance(llm, query, internal_answer)
+        except Exception:
+            if speculative_search is not None:
+                speculative_search.cancel()
+            raise
+        print(f"LLM judge relevance: {is_relevant}")
+        if speculative_search is not None and is_relevant:
+            # Not needed: drop it if it has not started yet, otherwise let it finish unobserved
+            speculative_search.cancel()
+            speculation_stats["discarded"] += 1
+            speculative_search = None
+    else:
+        is_relevant = decision == "accept"
+        print(f"Local relevance gate: {decision}")
 
     if not is_relevant:
         logger.info("LLM judge determined the internal answer does NOT address the query → routing to web.")
         route["mode"] = "web"
-        route["context"] = web_search_agent(query) # clear context if switching to web
+        if speculative_search is not None:
+            speculation_stats["used"] += 1
+            route["context"] = speculative_search.result()
+        else:
+            route["context"] = web_search_agent(query) # clear context if switching to web
+    logger.info(f"Routing stats: {routing_stats(gate)}")
     return route
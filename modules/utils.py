@@ -1,18 +1,178 @@
 # modules/utils.py
-import io, base64, json
-from pdf2image import convert_from_path
+import io, base64, json, os, time, hashlib, tempfile, threading, shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
+import config
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# Leading base64 characters of each format's magic bytes
+_BASE64_SIGNATURES = (("/9j/", "image/jpeg"), ("iVBORw0KGgo", "image/png"), ("UklGR", "image/webp"), ("R0lGOD", "image/gif"))
+
+
+class ImageEncoder:
+    """
+    Encodes PIL images for embedding in HTML: JPEG/WebP/PNG at a given quality, optionally
+    downscaled so the longest side is at most max_dim. Results are kept in a byte-bounded LRU
+    keyed by the source pixels' hash plus the encoding parameters, so a page shown again
+    (another citation, another mind-map node) is never re-encoded.
+    """
+
+    def __init__(self, format: str = config.IMAGE_FORMAT, quality: int = config.IMAGE_QUALITY,
+                 max_dim: int = config.IMAGE_MAX_DIM, cache_max_bytes: int = config.IMAGE_CACHE_MAX_BYTES):
+        self.format = format.upper()
+        if self.format not in _MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {format}")
+        self.quality = quality
+        self.max_dim = max_dim
+        self.cache_max_bytes = cache_max_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME_TYPES[self.format]
+
+    def _key(self, image: Image.Image) -> str:
+        digest = hashlib.sha256(f"{image.mode}:{image.size}:{self.format}:{self.quality}:{self.max_dim}".encode("utf-8"))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def encode(self, image: Image.Image) -> bytes:
+        key = self._key(image)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        if self.max_dim and max(image.size) > self.max_dim:
+            image = image.copy()
+            image.thumbnail((self.max_dim, self.max_dim), Image.BILINEAR, reducing_gap=2.0)
+        if self.format != "PNG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGBA" if self.format == "WEBP" and "A" in image.getbands() else "RGB")
+        buf = io.BytesIO()
+        if self.format == "PNG":
+            image.save(buf, format="PNG", compress_level=1)
+        else:
+            image.save(buf, format=self.format, quality=self.quality)
+        data = buf.getvalue()
+
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = data
+                self._cache_bytes += len(data)
+            while self._cache_bytes > self.cache_max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+        return data
+
+    def to_base64(self, image: Image.Image) -> str:
+        return base64.b64encode(self.encode(image)).decode()
+
+    def data_uri(self, image: Image.Image) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64(image)}"
+
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_image_encoder(format: str = config.IMAGE_FORMAT, quality: int = config.IMAGE_QUALITY,
+                      max_dim: int = config.IMAGE_MAX_DIM) -> ImageEncoder:
+    """Process-wide encoder per parameter set, so their caches are shared."""
+    key = (format.upper(), quality, max_dim)
+    with _encoders_lock:
+        if key not in _encoders:
+            _encoders[key] = ImageEncoder(format, quality, max_dim)
+        return _encoders[key]
+
+
+def pil_to_base64(image: Image.Image, format: str = config.IMAGE_FORMAT, quality: int = config.IMAGE_QUALITY,
+                  max_dim: int = config.IMAGE_MAX_DIM) -> str:
+    """Base64 of the encoded image (JPEG by default; pair with base64_data_uri to build an <img> src)."""
+    return get_image_encoder(format, quality, max_dim).to_base64(image)
+
+
+def base64_mime_type(image_b64: str) -> str:
+    """MIME type of base64 image data from its magic bytes (PNG if unknown, the historical default)."""
+    for prefix, mime_type in _BASE64_SIGNATURES:
+        if image_b64.startswith(prefix):
+            return mime_type
+    return "image/png"
+
+
+def base64_data_uri(image_b64: str) -> str:
+    return f"data:{base64_mime_type(image_b64)};base64,{image_b64}" if image_b64 else ""
+
+
+def thumbnail_base64(image_b64: str, max_dim: int, format: str = config.IMAGE_FORMAT,
+                     quality: int = config.IMAGE_QUALITY) -> str:
+    """Re-encode base64 image data as a smaller thumbnail; returns the input unchanged if it cannot be decoded."""
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(image_b64))) as image:
+            if image.format == "JPEG":
+                image.draft("RGB", (max_dim, max_dim))  # let libjpeg decode at reduced size
+            image.load()
+            return get_image_encoder(format, quality, max_dim).to_base64(image)
+    except Exception:
+        return image_b64
+
+def _render_page_range(pdf_path: str, dpi: int, first_page: int, last_page: int, output_dir: str):
+    """
+    Rasterize pages [first_page, last_page] to PPM files in output_dir; returns their paths in page order.
+    PPM is pdftoppm's native output: no compression when writing, no decompression when reading back.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+                      output_folder=output_dir, fmt="ppm", paths_only=True)
+    return sorted(os.path.join(output_dir, name) for name in os.listdir(output_dir))
+
+
+def iter_pdf_images(pdf_path: str, dpi: int = 200, batch_pages: int = config.PDF_RENDER_BATCH_PAGES,
+                    workers: int = config.PDF_RENDER_WORKERS):
+    """
+    Yield the PDF's pages as PIL.Images, one at a time and in page order.
+    Page ranges of `batch_pages` are rendered by up to `workers` parallel pdftoppm processes into a
+    temp directory, at most `workers + 1` ranges ahead of the consumer, so peak memory is one page
+    and peak disk is a few batches regardless of document length.
+    """
+    n_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    ranges = [(first, min(first + batch_pages - 1, n_pages)) for first in range(1, n_pages + 1, batch_pages)]
+    temp_dir = tempfile.mkdtemp(prefix="pdf_pages_")
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pdf-render")
+    pending = []
+    try:
+        submitted = 0
+        for _ in range(len(ranges)):
+            # Keep the pipeline full but bounded
+            while submitted < len(ranges) and len(pending) < max(1, workers) + 1:
+                first, last = ranges[submitted]
+                output_dir = os.path.join(temp_dir, f"{first:06d}")
+                pending.append((executor.submit(_render_page_range, pdf_path, dpi, first, last, output_dir), output_dir))
+                submitted += 1
+            future, output_dir = pending.pop(0)
+            for path in future.result():
+                with Image.open(path) as image:
+                    image.load()
+                    page = image.copy()
+                os.remove(path)
+                yield page
+            shutil.rmtree(output_dir, ignore_errors=True)
+    finally:
+        for future, _ in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-def pil_to_base64(image: Image.Image) -> str:
-    buf = io.BytesIO()
-    image.save(buf, format="PNG")
-    return base64.b64encode(buf.getvalue()).decode()
 
 def convert_pdf_to_images_safe(pdf_path: str, dpi: int = 200):
     """
     Convert each PDF page to a PIL.Image list.
+    Holds every page in memory; prefer iter_pdf_images for long documents.
     """
-    return convert_from_path(pdf_path, dpi=dpi)
+    return list(iter_pdf_images(pdf_path, dpi=dpi))
 
 def save_json(path: str, data: dict):
     with open(path, "w", encoding="utf-8") as f:
@@ -22,3 +182,126 @@ def load_json(path: str):
     with open(path, "r", encoding="utf-8") as f:
         import json
         return json.load(f)
+
+def file_sha256(path: str) -> str:
+    """Hex SHA-256 of a file's bytes, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded on-disk byte store: one file per key, least-recently-used eviction
+    by total bytes / entry count, and an optional TTL measured from the write time.
+    Safe to share between threads of one process.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None, max_entries: int = None,
+                 ttl: float = None, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._index = {}  # file name -> [size, written_at, last_used]
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                self._index[entry.name] = [stat.st_size, stat.st_mtime, stat.st_mtime]
+                self._total_bytes += stat.st_size
+
+    def _name(self, key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest() + self.suffix
+
+    def _remove(self, name: str):
+        """Drop an entry; caller holds the lock."""
+        size = self._index.pop(name, [0])[0]
+        self._total_bytes -= size
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _expired(self, meta, now: float) -> bool:
+        return self.ttl is not None and now - meta[1] > self.ttl
+
+    def get(self, key: str):
+        """Return the stored bytes, or None on a miss / expired entry."""
+        name = self._name(key)
+        now = time.time()
+        with self._lock:
+            meta = self._index.get(name)
+            if meta is None:
+                return None
+            if self._expired(meta, now):
+                self._remove(name)
+                return None
+            meta[2] = now
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._index.pop(name, None)
+            return None
+
+    def path(self, key: str):
+        """Return the file path of a live entry (for consumers that need a file), or None."""
+        name = self._name(key)
+        now = time.time()
+        with self._lock:
+            meta = self._index.get(name)
+            if meta is None or self._expired(meta, now):
+                return None
+            meta[2] = now
+        return os.path.join(self.directory, name)
+
+    def set(self, key: str, data: bytes):
+        """Atomically store bytes under key, then evict down to the configured bounds."""
+        name = self._name(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        now = time.time()
+        with self._lock:
+            self._total_bytes -= self._index.get(name, [0])[0]
+            self._index[name] = [len(data), now, now]
+            self._total_bytes += len(data)
+            self._evict(now)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(self._name(key))
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._index):
+                self._remove(name)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least-recently-used ones until within bounds; caller holds the lock."""
+        for name in [n for n, meta in self._index.items() if self._expired(meta, now)]:
+            self._remove(name)
+        over_bytes = self.max_bytes is not None and self._total_bytes > self.max_bytes
+        over_entries = self.max_entries is not None and len(self._index) > self.max_entries
+        if not (over_bytes or over_entries):
+            return
+        for name in sorted(self._index, key=lambda n: self._index[n][2]):
+            if (self.max_bytes is None or self._total_bytes <= self.max_bytes) and \
+               (self.max_entries is None or len(self._index) <= self.max_entries):
+                break
+            self._remove(name)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self):
+        return len(self._index)